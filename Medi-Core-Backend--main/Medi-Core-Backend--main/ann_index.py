@@ -0,0 +1,143 @@
+"""FAISS index types for the per-user knowledge base partitions.
+
+Partitions start as an exact ``IndexFlatL2`` and are promoted to an
+approximate index once they grow past ``promote_at`` vectors:
+
+* ``hnsw`` - ``IndexHNSWFlat``; no training, ``ef_search`` trades recall for speed
+* ``ivf`` - ``IndexIVFFlat``; k-means coarse quantizer, ``nprobe`` lists scanned
+* ``ivfpq`` - ``IndexIVFPQ``; like ``ivf`` with product-quantized vectors
+* ``flat`` - never promote
+
+The policy is read from ``VECTOR_INDEX_TYPE``, ``VECTOR_INDEX_PROMOTE_AT``,
+``VECTOR_INDEX_NPROBE`` and ``VECTOR_INDEX_EF_SEARCH``.
+
+faiss and numpy are imported inside the functions that need them so that
+importing ``SearchParams`` stays cheap for the web layer.
+"""
+import os
+import math
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Optional, Sequence
+
+if TYPE_CHECKING:
+    import faiss
+    import numpy as np
+
+INDEX_TYPES = ("flat", "hnsw", "ivf", "ivfpq")
+
+# Fewer points than this and k-means training is meaningless
+_MIN_TRAINING_POINTS = {"ivf": 64, "ivfpq": 256}
+
+
+@dataclass
+class SearchParams:
+    """Per-request overrides for approximate search."""
+    nprobe: Optional[int] = None
+    ef_search: Optional[int] = None
+
+
+@dataclass
+class IndexPolicy:
+    index_type: str = "hnsw"
+    promote_at: int = 200_000
+    hnsw_m: int = 32
+    ef_construction: int = 200
+    ef_search: int = 64
+    nlist: Optional[int] = None
+    nprobe: int = 16
+    pq_m: int = 16
+    pq_bits: int = 8
+
+    @classmethod
+    def from_env(cls) -> "IndexPolicy":
+        index_type = os.getenv("VECTOR_INDEX_TYPE", "hnsw").lower()
+        if index_type not in INDEX_TYPES:
+            raise ValueError(f"Unknown vector index type: {index_type}")
+        return cls(
+            index_type=index_type,
+            promote_at=int(os.getenv("VECTOR_INDEX_PROMOTE_AT", "200000")),
+            nprobe=int(os.getenv("VECTOR_INDEX_NPROBE", "16")),
+            ef_search=int(os.getenv("VECTOR_INDEX_EF_SEARCH", "64")),
+        )
+
+    def target_type(self, ntotal: int) -> str:
+        """Index type a partition of ``ntotal`` vectors should use."""
+        if self.index_type == "flat":
+            return "flat"
+        if ntotal < self.promote_at or not can_build(self.index_type, ntotal):
+            return "flat"
+        return self.index_type
+
+    def nlist_for(self, ntotal: int) -> int:
+        return self.nlist or max(1, int(4 * math.sqrt(ntotal)))
+
+
+def can_build(index_type: str, ntotal: int) -> bool:
+    return ntotal >= _MIN_TRAINING_POINTS.get(index_type, 0)
+
+
+def index_type_of(index: "faiss.Index") -> str:
+    import faiss
+
+    if isinstance(index, faiss.IndexHNSW):
+        return "hnsw"
+    if isinstance(index, faiss.IndexIVFPQ):
+        return "ivfpq"
+    if isinstance(index, faiss.IndexIVF):
+        return "ivf"
+    return "flat"
+
+
+def reconstruct(index: "faiss.Index", positions: Sequence[int]) -> "np.ndarray":
+    """Fetch stored vectors by position; lossy for IVF-PQ."""
+    import faiss
+    import numpy as np
+
+    if isinstance(index, faiss.IndexIVF) and index.direct_map.type == faiss.DirectMap.NoMap:
+        index.make_direct_map()
+    if not len(positions):
+        return np.empty((0, index.d), dtype=np.float32)
+    return np.vstack([index.reconstruct(int(position)) for position in positions]).astype(np.float32)
+
+
+def build_index(index_type: str, vectors: "np.ndarray", policy: IndexPolicy) -> "faiss.Index":
+    """Create an index of the given type, train it if needed and add ``vectors``."""
+    import faiss
+
+    dim = vectors.shape[1]
+    if index_type == "flat":
+        index = faiss.IndexFlatL2(dim)
+    elif index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, policy.hnsw_m)
+        index.hnsw.efConstruction = policy.ef_construction
+        index.hnsw.efSearch = policy.ef_search
+    elif index_type in ("ivf", "ivfpq"):
+        quantizer = faiss.IndexFlatL2(dim)
+        nlist = min(policy.nlist_for(len(vectors)), len(vectors))
+        if index_type == "ivf":
+            index = faiss.IndexIVFFlat(quantizer, dim, nlist)
+        else:
+            index = faiss.IndexIVFPQ(quantizer, dim, nlist, policy.pq_m, policy.pq_bits)
+        index.train(vectors)
+        index.nprobe = policy.nprobe
+    else:
+        raise ValueError(f"Unknown vector index type: {index_type}")
+
+    index.add(vectors)
+    if isinstance(index, faiss.IndexIVF):
+        # Keep vectors addressable by position for merges, compaction and re-promotion
+        index.make_direct_map()
+    return index
+
+
+def search_parameters(index: "faiss.Index", params: Optional[SearchParams]):
+    """Translate per-request overrides into FAISS search parameters for ``index``."""
+    import faiss
+
+    if params is None:
+        return None
+    if isinstance(index, faiss.IndexHNSW) and params.ef_search:
+        return faiss.SearchParametersHNSW(efSearch=params.ef_search)
+    if isinstance(index, faiss.IndexIVF) and params.nprobe:
+        return faiss.SearchParametersIVF(nprobe=params.nprobe)
+    return None
@@ -0,0 +1,161 @@
+"""Cache of LLM answers for /ask and /chat.
+
+An answer is reused when the same user asks the same (normalized) question
+and retrieval returns the same chunks, so a cached answer is never served
+for context the model has not seen. With ``similarity_threshold`` set, a
+paraphrase also hits if its embedding is close enough to a cached question
+over the same chunks.
+
+Entries expire after ``ttl_seconds`` and all of a user's entries are dropped
+whenever their documents change (ingestion or deletion).
+"""
+import os
+import re
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Dict, Optional, Sequence, Set
+
+if TYPE_CHECKING:
+    import numpy as np
+    from langchain_core.documents import Document
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_question(question: str) -> str:
+    return " ".join(re.sub(r"[^\w\s]", " ", question.lower()).split())
+
+
+def context_key(docs: Sequence["Document"]) -> str:
+    """Hash of the retrieved chunk ids, in rank order; a merged passage counts every chunk in it."""
+    chunk_ids = [
+        f"{d.metadata.get('document_id')}:"
+        + ",".join(str(i) for i in d.metadata.get("chunk_indices", [d.metadata.get("chunk_index")]))
+        for d in docs
+    ]
+    return hashlib.sha256("|".join(chunk_ids).encode("utf-8")).hexdigest()
+
+
+@dataclass
+class _Entry:
+    answer: str
+    expires_at: float
+    question_vector: Optional["np.ndarray"] = None
+
+
+class AnswerCache:
+    """In-process LRU of answers keyed on (namespace, user, question, retrieved chunks)."""
+
+    def __init__(self, ttl_seconds: float = 3600.0, max_entries: int = 10000,
+                 similarity_threshold: Optional[float] = None):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.similarity_threshold = similarity_threshold
+        self._entries: "OrderedDict[tuple, _Entry]" = OrderedDict()
+        self._by_user: Dict[int, Set[tuple]] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+
+    @property
+    def semantic(self) -> bool:
+        return self.similarity_threshold is not None
+
+    def get(self, namespace: str, user_id: int, question: str, context_hash: str,
+            question_vector: Optional["np.ndarray"] = None) -> Optional[str]:
+        key = (namespace, user_id, normalize_question(question), context_hash)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires_at > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry.answer
+            if entry is not None:
+                self._drop(key)
+
+            if self.semantic and question_vector is not None:
+                key = self._closest(key, _normalized(question_vector), now)
+                if key is not None:
+                    self._entries.move_to_end(key)
+                    self.semantic_hits += 1
+                    return self._entries[key].answer
+
+            self.misses += 1
+            return None
+
+    def _closest(self, key: tuple, vector: "np.ndarray", now: float) -> Optional[tuple]:
+        namespace, user_id, _, context_hash = key
+        best_key, best_score = None, self.similarity_threshold
+        for candidate in list(self._by_user.get(user_id, ())):
+            if candidate[0] != namespace or candidate[3] != context_hash:
+                continue
+            entry = self._entries[candidate]
+            if entry.expires_at <= now:
+                self._drop(candidate)
+                continue
+            if entry.question_vector is None:
+                continue
+            score = float(entry.question_vector @ vector)
+            if score >= best_score:
+                best_key, best_score = candidate, score
+        return best_key
+
+    def put(self, namespace: str, user_id: int, question: str, context_hash: str, answer: str,
+            question_vector: Optional["np.ndarray"] = None) -> None:
+        key = (namespace, user_id, normalize_question(question), context_hash)
+        vector = _normalized(question_vector) if self.semantic and question_vector is not None else None
+        with self._lock:
+            self._entries[key] = _Entry(answer, time.monotonic() + self.ttl_seconds, vector)
+            self._entries.move_to_end(key)
+            self._by_user.setdefault(user_id, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._drop(next(iter(self._entries)))
+
+    def invalidate_user(self, user_id: int) -> int:
+        """Forget every answer for ``user_id``; returns how many were dropped."""
+        with self._lock:
+            keys = self._by_user.pop(user_id, set())
+            for key in keys:
+                self._entries.pop(key, None)
+        if keys:
+            logger.info(f"Dropped {len(keys)} cached answers for user_id={user_id}")
+        return len(keys)
+
+    def _drop(self, key: tuple) -> None:
+        self._entries.pop(key, None)
+        keys = self._by_user.get(key[1])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_user[key[1]]
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "semantic_hits": self.semantic_hits,
+                "misses": self.misses,
+                "entries": len(self._entries),
+            }
+
+
+def _normalized(vector) -> "np.ndarray":
+    import numpy as np
+
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+_similarity = os.getenv("ANSWER_CACHE_SIMILARITY")
+answer_cache = AnswerCache(
+    ttl_seconds=float(os.getenv("ANSWER_CACHE_TTL_SECONDS", "3600")),
+    max_entries=int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "10000")),
+    similarity_threshold=float(_similarity) if _similarity else None,
+)
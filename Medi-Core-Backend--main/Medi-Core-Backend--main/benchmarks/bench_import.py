@@ -0,0 +1,66 @@
+"""Measure how long ``import main`` takes in a fresh interpreter.
+
+Heavy dependencies (FAISS, the embedding backend, LangChain splitters and the
+Gemini SDK) are loaded lazily, so the web app should import well within the
+budget. Exits non-zero when the median is over ``--budget`` seconds so it can
+guard against regressions in CI.
+
+    python benchmarks/bench_import.py --runs 5 --budget 1.5
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def time_import(module: str) -> float:
+    env = {**os.environ, "WARMUP_ON_STARTUP": "false", "GOOGLE_API_KEY": os.getenv("GOOGLE_API_KEY", "unused")}
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "-c", f"import {module}"], cwd=BACKEND_DIR, env=env, check=True)
+    return time.perf_counter() - start
+
+
+def slowest_imports(module: str, top: int):
+    """Cumulative import times from ``python -X importtime``, slowest first."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=BACKEND_DIR, capture_output=True, text=True, check=True,
+    )
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        # Direct imports of the module only; nested ones are already counted in them
+        if name.startswith("   ") and not name.startswith("    "):
+            rows.append((int(cumulative), name.strip()))
+    return sorted(rows, reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--module", default="main")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget", type=float, default=1.5, help="seconds")
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+
+    timings = [time_import(args.module) for _ in range(args.runs)]
+    median = statistics.median(timings)
+    print(f"import {args.module}: median {median:.3f}s, min {min(timings):.3f}s, max {max(timings):.3f}s")
+
+    print("\nSlowest imports made by the module:")
+    for cumulative_us, name in slowest_imports(args.module, args.top):
+        print(f"  {cumulative_us / 1e6:7.3f}s  {name}")
+
+    if median > args.budget:
+        print(f"\nOver budget: {median:.3f}s > {args.budget:.3f}s")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
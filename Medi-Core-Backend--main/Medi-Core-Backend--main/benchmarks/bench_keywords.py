@@ -0,0 +1,96 @@
+"""Compare the compiled keyword matcher with the old per-keyword substring loops.
+
+The old code lowered each message and ran ``kw in message`` once per keyword
+and per set (red flags, restart, symptoms); the matcher scans the message
+once for all three. Also prints the messages where the two disagree, e.g.
+"fit" firing on "benefit". Fails if an inflected red flag ("seizures",
+"convulsions", "blindness") is not caught, or if one of the false alarms
+("can't seem", "fitness", "painting") is flagged.
+
+    python benchmarks/bench_keywords.py --number 20000
+"""
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from keyword_matcher import keyword_matcher  # noqa: E402
+
+# The matcher must flag these like the substring loops did
+INFLECTED_RED_FLAGS = [
+    "I keep having seizures since this morning",
+    "He had convulsions last night",
+    "I woke up with sudden blindness in my left eye",
+]
+
+# The matcher must not flag these; the substring loops did
+FALSE_ALARMS = [
+    ("I can't seem to shake this cough", "red_flags"),
+    ("I go to a fitness class twice a week", "red_flags"),
+    ("The new brace fitted well", "red_flags"),
+    ("Would it benefit me to rest more?", "red_flags"),
+    ("We passed outside the clinic on the way home", "red_flags"),
+    ("I unconsciously scratch my arm at night", "red_flags"),
+    ("I spent the weekend painting the kitchen", "symptoms"),
+]
+
+MESSAGES = [
+    "I have had a headache and some nausea since yesterday morning",
+    "My chest pain with shortness of breath started an hour ago",
+    "Would it benefit me to take ibuprofen for my joint pain?",
+    "I feel fine, just a mild cough and fatigue after the flu",
+    "She had a seizure and then passed out for a minute",
+    "Can you restart the assessment please",
+    "The pain is in my lower back and gets worse when I sit for a long time at work",
+    "I was painting the fence and my shoulder started to ache",
+    *INFLECTED_RED_FLAGS,
+    *(message for message, _ in FALSE_ALARMS),
+]
+
+
+def substring_scan(message: str):
+    message_lower = message.lower()
+    sets = keyword_matcher.keyword_sets
+    return {
+        category: [kw for kw in sets[category] if kw in message_lower]
+        for category in ("red_flags", "restart", "symptoms")
+    }
+
+
+def matcher_scan(message: str):
+    found = {category: [] for category in ("red_flags", "restart", "symptoms")}
+    for hit in keyword_matcher.scan(message):
+        found[hit.category].append(hit.keyword)
+    return found
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--number", type=int, default=20000, help="passes over the sample messages")
+    args = parser.parse_args()
+
+    for name, scan in (("substring loops", substring_scan), ("keyword matcher", matcher_scan)):
+        seconds = timeit.timeit(lambda: [scan(m) for m in MESSAGES], number=args.number)
+        per_message = seconds / (args.number * len(MESSAGES)) * 1e6
+        print(f"{name:16s} {per_message:7.2f} us/message")
+
+    print("\nDifferences (substring loops -> keyword matcher):")
+    for message in MESSAGES:
+        old, new = substring_scan(message), matcher_scan(message)
+        for category in old:
+            removed = sorted(set(old[category]) - set(new[category]))
+            added = sorted(set(new[category]) - set(old[category]))
+            if removed or added:
+                print(f"  {message!r} [{category}] dropped={removed} added={added}")
+    missed = [message for message in INFLECTED_RED_FLAGS if not keyword_matcher.has(message, "red_flags")]
+    if missed:
+        sys.exit(f"Inflected red flags missed by the keyword matcher: {missed}")
+    flagged = [message for message, category in FALSE_ALARMS if keyword_matcher.has(message, category)]
+    if flagged:
+        sys.exit(f"False alarms flagged by the keyword matcher: {flagged}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""Concurrent read/write throughput of the SQLite profiles.
+
+Reader threads page through a session's chat messages (what /chat-history
+does) while writer threads append triage turns (what the message log
+does), against a scratch copy of the schema:
+
+* ``default`` - SQLite's rollback journal and settings, every writer
+  committing on its own connection
+* ``tuned`` - the db_profile pragmas (WAL, synchronous=NORMAL, mmap, cache,
+  busy_timeout) with writes funnelled through one WriteQueue thread
+
+    python benchmarks/bench_sqlite.py --readers 8 --writers 4 --seconds 5
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, select  # noqa: E402
+from sqlalchemy.exc import OperationalError  # noqa: E402
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+
+from database import Base, ChatMessage, ChatSession, User  # noqa: E402
+from db_profile import WriteQueue, configure_engine, engine_options  # noqa: E402
+
+SESSIONS = 50
+
+
+def build(path: str, profile: str):
+    engine = create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False},
+                           **engine_options(create_engine(f"sqlite:///{path}").url))
+    configure_engine(engine, profile)
+    Base.metadata.create_all(engine)
+    factory = sessionmaker(bind=engine, autoflush=False)
+    with factory() as db:
+        db.add(User(id=1, email="bench@example.com", full_name="Bench", hashed_password="-"))
+        for i in range(SESSIONS):
+            db.add(ChatSession(session_id=f"s{i}", user_id=1, stage="greeting"))
+            db.add_all(ChatMessage(session_id=f"s{i}", user_id=1, message_type="user",
+                                   content="seed message " * 10, stage="greeting") for _ in range(20))
+        db.commit()
+    return engine, factory
+
+
+def add_turn(db, n: int) -> None:
+    session_id = f"s{n % SESSIONS}"
+    db.add(ChatMessage(session_id=session_id, user_id=1, message_type="user", content=f"turn {n}", stage="consent"))
+    db.add(ChatMessage(session_id=session_id, user_id=1, message_type="bot", content=f"reply {n}", stage="consent"))
+    db.query(ChatSession).filter(ChatSession.session_id == session_id).update({"stage": "consent"})
+
+
+def run(profile: str, readers: int, writers: int, seconds: float) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        engine, factory = build(os.path.join(tmp, "bench.db"), profile)
+        queue = WriteQueue(factory) if profile == "tuned" else None
+        counts = {"reads": 0, "writes": 0, "errors": 0}
+        lock = threading.Lock()
+        stop = time.perf_counter() + seconds
+
+        def bump(key: str) -> None:
+            with lock:
+                counts[key] += 1
+
+        def reader(worker: int) -> None:
+            n = worker
+            while time.perf_counter() < stop:
+                try:
+                    with factory() as db:
+                        db.scalars(
+                            select(ChatMessage).where(ChatMessage.session_id == f"s{n % SESSIONS}")
+                            .order_by(ChatMessage.timestamp.desc()).limit(50)
+                        ).all()
+                    bump("reads")
+                except OperationalError:
+                    bump("errors")
+                n += readers
+
+        def writer(worker: int) -> None:
+            n = worker
+            while time.perf_counter() < stop:
+                try:
+                    if queue is not None:
+                        queue.submit(add_turn, n).result()
+                    else:
+                        with factory() as db:
+                            add_turn(db, n)
+                            db.commit()
+                    bump("writes")
+                except OperationalError:
+                    bump("errors")
+                n += writers
+
+        threads = [threading.Thread(target=reader, args=(i,)) for i in range(readers)]
+        threads += [threading.Thread(target=writer, args=(i,)) for i in range(writers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if queue is not None:
+            queue.close()
+        engine.dispose()
+    return {key: value / seconds for key, value in counts.items()}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--readers", type=int, default=8)
+    parser.add_argument("--writers", type=int, default=4)
+    parser.add_argument("--seconds", type=float, default=5.0)
+    args = parser.parse_args()
+
+    print(f"{args.readers} readers, {args.writers} writers, {args.seconds:.0f}s per profile")
+    for profile in ("default", "tuned"):
+        result = run(profile, args.readers, args.writers, args.seconds)
+        print(f"{profile:8s} reads/s {result['reads']:9.0f}   writes/s {result['writes']:8.0f}"
+              f"   lock errors/s {result['errors']:6.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,94 +1,76 @@
-import os
-import pickle
+import json
 import logging
 import re
+from contextlib import aclosing
 from uuid import uuid4
-from typing import Dict, List, Any, Optional
+from typing import TYPE_CHECKING, Dict, List, Any, Optional
 from datetime import datetime
-from enum import Enum
 from fastapi import APIRouter, UploadFile, File, Form, HTTPException
-from fastapi.responses import PlainTextResponse
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
-import google.generativeai as genai
-from langchain_community.document_loaders import PyPDFLoader
-from langchain_community.vectorstores import FAISS
-from langchain_huggingface import HuggingFaceEmbeddings
 from dotenv import load_dotenv
-from sqlalchemy.orm import Session
-from database import get_db, ChatSession as DBChatSession, ChatMessage as DBChatMessage, User as DBUser
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import get_db, ChatSession as DBChatSession, User as DBUser
 from auth.auth_handler import get_current_active_user
 from fastapi import Depends
-from rag_system import rag_system
-from langchain_core.documents import Document
-import aiofiles 
+from rag_system import aget_rag_system, get_rag_system
+from ann_index import SearchParams
+from ingest_jobs import enqueue_upload, get_job_status
+from llm_gateway import llm_gateway, LLMTimeoutError
+from answer_cache import answer_cache, context_key
+from context_packing import pack_context
+from keyword_matcher import keyword_matcher
+from red_flag_detector import detect_red_flag
+from session_store import TriageSession, TriageStage, session_store
+from message_log import TriageWrite, message_log
+
+if TYPE_CHECKING:
+    from langchain_core.documents import Document
 
 load_dotenv()
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
-# Configure AI model
-api_key = os.getenv("GOOGLE_API_KEY")
-if not api_key:
-    raise ValueError("GOOGLE_API_KEY environment variable not set")
-
-genai.configure(api_key=api_key)
-model = genai.GenerativeModel("gemini-2.0-flash-exp")
-
-# Global vector store
-
-VECTOR_STORE_PATH = "vector_store.pkl"
-if os.path.exists(VECTOR_STORE_PATH):
-    with open(VECTOR_STORE_PATH, "rb") as f:
-        loaded_store = pickle.load(f)
-    rag_system.vector_store = loaded_store
-
-vector_store = rag_system.vector_store
-
-
-# Medical triage stages
-class TriageStage(Enum):
-    GREETING = "greeting"
-    CONSENT = "consent"
-    DEMOGRAPHICS = "demographics"
-    MEDICAL_HISTORY = "medical_history"
-    MAIN_SYMPTOMS = "main_symptoms"
-    SYMPTOM_DETAILS = "symptom_details"
-    ASSOCIATED_SYMPTOMS = "associated_symptoms"
-    SUMMARY_CONFIRMATION = "summary_confirmation"
-    FINAL_ASSESSMENT = "final_assessment"
-    COMPLETED = "completed"
-
-class TriageSession:
-    def __init__(self):
-        self.stage = TriageStage.GREETING
-        self.data = {}
-        self.completed = False
-        self.created_at = datetime.now()
-        self.red_flags_detected = False
-
-# In-memory session storage
-triage_sessions: Dict[str, TriageSession] = {}
+# Stages whose answers describe symptoms; consent, demographics and history replies skip the semantic check
+SEMANTIC_RED_FLAG_STAGES = frozenset({
+    TriageStage.MAIN_SYMPTOMS,
+    TriageStage.SYMPTOM_DETAILS,
+    TriageStage.ASSOCIATED_SYMPTOMS,
+    TriageStage.SUMMARY_CONFIRMATION,
+})
 
 # Knowledge base integration
 class MedicalKnowledgeBase:
-    def __init__(self, vector_store, user_id: Optional[int] = None):
-        self.vector_store = vector_store
+    """A user's view of the shared RAG engine."""
+    def __init__(self, user_id: Optional[int] = None, engine=None):
+        self._engine = engine
         self.user_id = user_id
 
-    def query(self, text: str, k: int = 3) -> List[Document]:
-        if not self.vector_store:
+    @property
+    def engine(self):
+        return self._engine or get_rag_system()
+
+    def query(self, text: str, k: int = 3) -> List["Document"]:
+        if self.user_id is None:
+            return []
+        return self.engine.search_knowledge_base(text, k=k, user_id=self.user_id)
+
+    async def aquery(self, text: str, k: int = 3) -> List["Document"]:
+        if self.user_id is None:
             return []
-        # similarity_search returns Documents
-        docs = self.vector_store.similarity_search(text, k=k)
-        # Optionally filter by metadata["user_id"]
-        if self.user_id:
-            docs = [d for d in docs if d.metadata.get("user_id")==self.user_id]
-        return docs
-
-    def get_context(self, text: str, k: int = 3) -> str:
+        engine = self._engine or await aget_rag_system()
+        return await engine.asearch_knowledge_base(text, k=k, user_id=self.user_id)
+
+    def get_context(self, text: str, k: int = 3, max_tokens: Optional[int] = None) -> str:
         docs = self.query(text, k)
-        return " ".join(d.page_content for d in docs)
+        return pack_context(docs, max_tokens).text
+
+    async def aget_context(self, text: str, k: int = 3, max_tokens: Optional[int] = None) -> str:
+        docs = await self.aquery(text, k)
+        return pack_context(docs, max_tokens).text
 
 
 #helper functions for formatting
@@ -141,6 +123,52 @@ def clean_markdown(text: str) -> str:
     return text
 
 
+class _EmphasisStripper:
+    """One pass of clean_markdown over text that arrives in pieces.
+
+    Text is released up to the first opening marker whose closing marker has
+    not arrived yet, so the output matches ``re.sub`` on the whole text.
+    """
+    def __init__(self, markers):
+        self.markers = markers
+        self.width = len(markers[0])
+        self.buffer = ""
+
+    def feed(self, text: str, final: bool = False) -> str:
+        self.buffer += text
+        buffer, out, i = self.buffer, [], 0
+        while i < len(buffer):
+            marker = buffer[i:i + self.width]
+            if marker in self.markers:
+                end = buffer.find(marker, i + self.width)
+                if end != -1:
+                    out.append(buffer[i + self.width:end])
+                    i = end + self.width
+                    continue
+                if not final:
+                    break
+            elif not final and self.width > 1 and buffer[i:] in ("*", "_"):
+                # Could still become "**" or "__" with the next chunk
+                break
+            out.append(buffer[i])
+            i += 1
+        self.buffer = buffer[i:]
+        return "".join(out)
+
+
+class MarkdownStreamCleaner:
+    """Incremental clean_markdown for streamed LLM output."""
+    def __init__(self):
+        self._bold = _EmphasisStripper(("**", "__"))
+        self._italics = _EmphasisStripper(("*", "_"))
+
+    def feed(self, chunk: str) -> str:
+        return self._italics.feed(self._bold.feed(chunk))
+
+    def flush(self) -> str:
+        return self._italics.feed(self._bold.feed("", final=True), final=True)
+
+
 
 # Request/Response models
 class ChatRequest(BaseModel):
@@ -156,67 +184,34 @@ class ChatResponse(BaseModel):
     extracted_info: Dict[str, Any] = {}
     
 
-# Red flag symptoms for emergency detection
-RED_FLAG_SYMPTOMS = [
-    "worst headache of my life", "worst headache ever", "thunderclap headache",
-    "loss of consciousness", "passed out", "fainted", "unconscious",
-    "difficulty speaking", "slurred speech", "can't speak properly",
-    "weakness on one side", "paralysis", "can't move arm", "can't move leg",
-    "chest pain with shortness of breath", "crushing chest pain",
-    "severe difficulty breathing", "can't breathe", "gasping for air",
-    "severe abdominal pain", "worst stomach pain ever",
-    "blood in vomit", "vomiting blood", "threw up blood",
-    "blood in stool", "bloody stool", "rectal bleeding",
-    "seizure", "convulsion", "fit", "shaking uncontrollably",
-    "sudden vision loss", "blind", "can't see",
-    "high fever with stiff neck", "neck stiffness with fever",
-    "severe allergic reaction", "anaphylaxis", "throat closing"
-]
-
 @router.post("/triage", response_model=ChatResponse)
 async def medical_triage(
     req: ChatRequest,
     current_user: DBUser = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Complete medical triage conversation following clinical protocols with database storage."""
     
     sess_id = req.session_id or str(uuid4())
-    session = triage_sessions.get(sess_id, TriageSession())
-    triage_sessions[sess_id] = session
+    # Rebuilt from the ChatSession row if it is not in the session store; the row is created by the first write
+    session = await load_triage_session(db, sess_id, current_user.id) or TriageSession()
     session.data["user_id"] = current_user.id
-
-    # Get or create database session
-    db_session = db.query(DBChatSession).filter(DBChatSession.session_id == sess_id).first()
-    if not db_session:
-        db_session = DBChatSession(
-            session_id=sess_id,
-            user_id=current_user.id,
-            stage=TriageStage.GREETING.value
-        )
-        db.add(db_session)
-        db.commit()
-        db.refresh(db_session)
-    
     
     message = req.message.strip()
     
+    # One scan finds restart and red-flag keywords alike (sets in triage_keywords.json)
+    matched = {hit.category for hit in keyword_matcher.scan(message)}
+
     # ==== BEGIN RESTART PATCH ====
     # Enable restart if user types anything like "restart", "restart assessment", "start again", etc.
-
-    RESTART_KEYWORDS = [
-        "restart", "start again", "restart the assessment", "restart assessment",
-        "begin again", "new assessment", "new triage", "reset", "repeat"
-    ]
-
-    message_lower = message.lower()
-    if session.completed or any(kw in message_lower for kw in RESTART_KEYWORDS):
+    if session.completed or "restart" in matched:
         # If user types any restart-variant, reset session
-        if any(kw in message_lower for kw in RESTART_KEYWORDS):
+        if "restart" in matched:
             session = TriageSession()
             session.data["user_id"] = current_user.id
-            triage_sessions[sess_id] = session
             reply = handle_greeting(session, message)
+            await message_log.write(TriageWrite(sess_id, current_user.id, session_fields=reset_fields(session)))
+            await session_store.asave(sess_id, session)
             return ChatResponse(
                 session_id=sess_id,
                 reply=reply,
@@ -244,28 +239,27 @@ async def medical_triage(
             )
     # ==== END RESTART PATCH ====
     
-    # Save user message to database
-    user_message = DBChatMessage(
-        session_id=sess_id,
-        user_id=current_user.id,
-        message_type="user",
-        content=message,
-        stage=session.stage.value
-    )
-    db.add(user_message)
+    # The turn's database writes are queued together and committed by the message log
+    turn = TriageWrite(sess_id, current_user.id)
+    turn.messages.append(("user", message, session.stage.value))
     
-    # Check for emergency keywords at any stage
-    if check_emergency_keywords(message):
+    # Check for emergency keywords at any stage, then for paraphrases of them in symptom answers
+    emergency = "red_flags" in matched or (
+        session.stage in SEMANTIC_RED_FLAG_STAGES and bool(await detect_red_flag(message))
+    )
+    if emergency:
         session.red_flags_detected = True
         session.stage = TriageStage.COMPLETED
         session.completed = True
         reply = generate_emergency_response()
         
         # Update database session
-        db_session.emergency_detected = True
-        db_session.completed = True
-        db_session.stage = TriageStage.COMPLETED.value
-        db_session.completed_at = datetime.now()
+        turn.session_fields.update(
+            emergency_detected=True,
+            completed=True,
+            stage=TriageStage.COMPLETED.value,
+            completed_at=datetime.now(),
+        )
         
     else:
         # Process based on current stage
@@ -275,51 +269,34 @@ async def medical_triage(
         if session.stage == TriageStage.COMPLETED and "CLINICAL SUMMARY" in reply:
             reply = clean_medical_assessment(reply)
 
-        # Update database session with collected data
-        if session.data.get('age'):
-            db_session.age = session.data['age']
-            # Also update user profile if not set
-            if not current_user.age:
-                current_user.age = session.data['age']
-                
-        if session.data.get('sex'):
-            db_session.sex = session.data['sex']
-            if not current_user.sex:
-                current_user.sex = session.data['sex']
-                
-        if session.data.get('medical_history'):
-            db_session.medical_history = session.data['medical_history']
-            if not current_user.medical_history:
-                current_user.medical_history = session.data['medical_history']
-        
-        # Update other session data
-        if session.data.get('main_symptoms'):
-            db_session.main_symptoms = session.data['main_symptoms']
-        if session.data.get('symptom_details'):
-            db_session.symptom_details = session.data['symptom_details']
-        if session.data.get('associated_symptoms'):
-            db_session.associated_symptoms = session.data['associated_symptoms']
+        # Update database session with collected data; age, sex and history also fill gaps in the user profile
+        for field in ("age", "sex", "medical_history"):
+            if session.data.get(field):
+                turn.session_fields[field] = session.data[field]
+                turn.user_fields[field] = session.data[field]
+        for field in ("main_symptoms", "symptom_details", "associated_symptoms"):
+            if session.data.get(field):
+                turn.session_fields[field] = session.data[field]
             
         # Update stage and completion status
-        db_session.stage = session.stage.value
-        db_session.completed = session.completed
+        turn.session_fields["stage"] = session.stage.value
+        turn.session_fields["completed"] = session.completed
         if session.completed:
-            db_session.completed_at = datetime.now()
+            turn.session_fields["completed_at"] = datetime.now()
             if reply and "CLINICAL SUMMARY" in reply:
-                db_session.final_assessment = reply
+                turn.session_fields["final_assessment"] = reply
     
     # Save bot response to database
-    bot_message = DBChatMessage(
-        session_id=sess_id,
-        user_id=current_user.id,
-        message_type="bot",
-        content=reply,
-        stage=session.stage.value
-    )
-    db.add(bot_message)
+    turn.messages.append(("bot", reply, session.stage.value))
     
-    # Commit all changes
-    db.commit()
+    # Emergencies are committed before replying; other turns are batched
+    try:
+        await message_log.write(turn, durable=emergency)
+    except Exception as e:
+        # The emergency advice still has to reach the user; keep retrying the record in the background
+        logger.error(f"Failed to commit emergency triage turn for session {sess_id}: {e}")
+        await message_log.write(turn)
+    await session_store.asave(sess_id, session)
     
     # Calculate progress
     total_stages = len(TriageStage) - 2  # Excluding COMPLETED
@@ -335,14 +312,42 @@ async def medical_triage(
         extracted_info={
             "data_collected": session.data,
             "red_flags": session.red_flags_detected,
-            "timestamp": db_session.created_at.isoformat()
+            "timestamp": session.created_at.isoformat()
         }
     )
 
+async def load_triage_session(db: AsyncSession, sess_id: str, user_id: int) -> Optional[TriageSession]:
+    """The session from the store, or rebuilt from its ChatSession row on a miss.
+
+    Raises 404 if ``sess_id`` belongs to another user.
+    """
+    not_found = HTTPException(status_code=404, detail="Triage session not found")
+    session = await session_store.aget(sess_id)
+    if session is not None:
+        if session.data.get("user_id") != user_id:
+            raise not_found
+        return session
+    db_session = await db.scalar(select(DBChatSession).where(DBChatSession.session_id == sess_id))
+    if db_session is None:
+        return None
+    if db_session.user_id != user_id:
+        raise not_found
+    session = TriageSession.from_chat_session(db_session)
+    await session_store.asave(sess_id, session)
+    return session
+
+
+def reset_fields(session: TriageSession) -> Dict[str, Any]:
+    """ChatSession columns for a restarted session, so reloading its row does not resume the old conversation."""
+    fields = dict.fromkeys(("age", "sex", "medical_history", "main_symptoms", "symptom_details",
+                            "associated_symptoms", "final_assessment", "completed_at"))
+    fields.update(stage=session.stage.value, completed=False, emergency_detected=False)
+    return fields
+
+
 def check_emergency_keywords(message: str) -> bool:
     """Check for emergency/red flag symptoms."""
-    message_lower = message.lower()
-    return any(red_flag in message_lower for red_flag in RED_FLAG_SYMPTOMS)
+    return keyword_matcher.has(message, "red_flags")
 
 def generate_emergency_response() -> str:
     """Generate emergency response for red flag symptoms."""
@@ -564,13 +569,24 @@ async def handle_summary_confirmation(session: TriageSession, message: str) -> s
             "and I'll update your records accordingly."
         )
 
-async def generate_final_assessment(session: TriageSession) -> str:
+ASSESSMENT_FALLBACK = (
+    "I apologize, but I'm experiencing technical difficulties generating your assessment.\n\n"
+    "Please consult with a healthcare professional immediately for proper evaluation.\n\n"
+    "If you're experiencing concerning symptoms, contact:\n"
+    "• Your primary care physician\n"
+    "• Urgent care center\n"
+    "• Emergency room (for severe symptoms)\n"
+    "• Call 112 for emergencies"
+)
+
+async def build_assessment_prompt(session: TriageSession) -> str:
+    """The final assessment prompt, with knowledge base context for the symptoms."""
     symptoms_text = (
         f"{session.data.get('main_symptoms','')} "
         f"{session.data.get('associated_symptoms','')}"
     )
-    kb = MedicalKnowledgeBase(vector_store, user_id=session.data.get("user_id"))
-    kb_context = kb.get_context(symptoms_text, k=3)
+    kb = MedicalKnowledgeBase(user_id=session.data.get("user_id"))
+    kb_context = await kb.aget_context(symptoms_text, k=3)
     
 
     # comprehensive assessment prompt
@@ -637,10 +653,13 @@ This assessment is for educational and informational purposes only. It does not
 ---
 Assessment completed using clinical decision support tools and medical knowledge database.
 """
-    
+    return prompt
+
+async def generate_final_assessment(session: TriageSession) -> str:
+    prompt = await build_assessment_prompt(session)
     try:
-        response = model.generate_content(prompt)
-        assessment = clean_markdown(response.text.strip())
+        response_text = await llm_gateway.generate(prompt, user_id=session.data.get("user_id"))
+        assessment = clean_markdown(response_text)
         
         # Mark session as completed
         # session.completed = True
@@ -654,75 +673,78 @@ Assessment completed using clinical decision support tools and medical knowledge
     except Exception as e:
         logger.error(f"Error generating medical assessment: {e}")
         session.completed = True
-        return (
-            "I apologize, but I'm experiencing technical difficulties generating your assessment.\n\n"
-            "Please consult with a healthcare professional immediately for proper evaluation.\n\n"
-            "If you're experiencing concerning symptoms, contact:\n"
-            "• Your primary care physician\n"
-            "• Urgent care center\n"
-            "• Emergency room (for severe symptoms)\n"
-            "• Call 112 for emergencies"
-        )
+        return ASSESSMENT_FALLBACK
 
 def extract_symptoms_from_text(text: str) -> List[str]:
     """Extract symptom keywords from text for knowledge base querying."""
-    common_symptoms = [
-        "headache", "fever", "cough", "pain", "nausea", "vomiting", "dizziness",
-        "fatigue", "weakness", "shortness of breath", "chest pain", "abdominal pain",
-        "diarrhea", "constipation", "rash", "swelling", "joint pain", "muscle pain"
-    ]
-    
-    text_lower = text.lower()
-    found_symptoms = [symptom for symptom in common_symptoms if symptom in text_lower]
-    return found_symptoms
+    return keyword_matcher.find(text, "symptoms")
 
 # Keep your existing endpoints
 @router.post("/upload")
 async def upload_pdfs(
     files: List[UploadFile] = File(...),
-    current_user: DBUser = Depends(get_current_active_user)
+    current_user: DBUser = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_db)
 ):
-    global vector_store
-    docs = []
-    for file in files:
-        content = await file.read()
-        path = os.path.join("uploads", file.filename)
-        os.makedirs("uploads", exist_ok=True)
-        with open(path, "wb") as f:
-            f.write(content)
-        loader = PyPDFLoader(path)
-        for doc in loader.load():
-            # attach user metadata
-            doc.metadata["user_id"] = current_user.id
-            docs.append(doc)
-
-    embeddings = HuggingFaceEmbeddings()
-    if vector_store is None:
-        vector_store = FAISS.from_documents(docs, embeddings)
-    else:
-        vector_store.add_documents(docs)
+    """Queue uploaded files for background ingestion into the user's knowledge base."""
+    jobs = [await enqueue_upload(file, current_user.id, db) for file in files]
+    return {"message": "Files queued for processing.", "jobs": jobs}
 
-    with open(VECTOR_STORE_PATH, "wb") as f:
-        pickle.dump(vector_store, f)
 
-    return {"message": "PDFs processed and knowledge base updated."}
+@router.get("/ingest-jobs/{job_id}")
+async def get_ingest_job(
+    job_id: int,
+    current_user: DBUser = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """Status and progress of a background ingestion job."""
+    job = await get_job_status(job_id, current_user.id, db)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Ingestion job not found")
+    return job
+
+
+async def answer_cache_key(kb, question: str, docs: List["Document"]):
+    """Context hash and (for paraphrase matching) question embedding for the answer cache."""
+    question_vector = None
+    if answer_cache.semantic:
+        # Already embedded by the search, so this is an embedding cache hit
+        question_vector = await kb.embeddings.aembed_query(question)
+    return context_key(docs), question_vector
+
+
+def source_snippets(docs: List["Document"]) -> List[Dict[str, Any]]:
+    return [
+        {
+            "filename": d.metadata.get("file_path", "Unknown").split('/')[-1],
+            "chunk_index": d.metadata.get("chunk_index", 0),
+            "content_preview": d.page_content[:200] + "..."
+        }
+        for d in docs
+    ]
 
 
 @router.post("/ask", response_class=PlainTextResponse)
 async def ask(
     prompt: str = Form(...),
+    nprobe: Optional[int] = Form(None),
+    ef_search: Optional[int] = Form(None),
     current_user: DBUser = Depends(get_current_active_user),
 ):
-    if rag_system.vector_store is None:
-        raise HTTPException(status_code=400, detail="Knowledge base is not ready. Upload documents first.")
-
     user_id = current_user.id
-    kb = rag_system
-    context = kb.get_context_for_query(prompt, user_id=user_id)
+    kb = await aget_rag_system()
+    search_params = SearchParams(nprobe=nprobe, ef_search=ef_search)
+    docs = await kb.asearch_knowledge_base(prompt, k=5, user_id=user_id, search_params=search_params)
+    context = kb.build_context(docs).text
 
     if not context:
         return "I couldn't find relevant information in your uploaded documents. Please upload documents first or rephrase your question."
 
+    context_hash, question_vector = await answer_cache_key(kb, prompt, docs)
+    cached = answer_cache.get("ask", user_id, prompt, context_hash, question_vector)
+    if cached is not None:
+        return cached
+
     prompt_template = f"""
 You are a medical AI assistant with access to the user's medical documents:
 
@@ -735,53 +757,56 @@ User question:
 Provide an accurate, concise answer based on the context above.
 """
 
-    response = model.generate_content(prompt_template)
+    try:
+        answer = await llm_gateway.generate(prompt_template, user_id=user_id)
+    except LLMTimeoutError as e:
+        raise HTTPException(status_code=504, detail=str(e))
 
-    return response.text.strip() or "No answer generated."
+    if answer:
+        answer_cache.put("ask", user_id, prompt, context_hash, answer, question_vector)
+    return answer or "No answer generated."
 
 import re
 
 
 
 
+def build_chat_prompt(context: str, query: str) -> str:
+    return f"""
+You are a medical AI assistant with access to the user's uploaded medical documents below.
+
+Context:
+{context}
+
+User question:
+{query}
+
+Please provide an accurate and concise answer based on the above context.
+"""
+
+
 # Simple chat endpoint (existing functionality)
 @router.post("/chat")
 async def chat(
     files: Optional[List[UploadFile]] = File(None),
     query: Optional[str] = Form(None),
+    nprobe: Optional[int] = Form(None),
+    ef_search: Optional[int] = Form(None),
     current_user: DBUser = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     upload_results = []
     answer = None
     sources = []
+    context_tokens = None
 
-    # Handle file uploads
+    # Queue file uploads; progress is available from /ingest-jobs/{job_id}
     if files:
-        uploads_folder = "uploads"
-        os.makedirs(uploads_folder, exist_ok=True)
-
         for file in files:
-            ext = file.filename.split(".")[-1].lower()
-            if ext not in ('pdf', 'docx', 'doc', 'txt', 'xlsx', 'xls'):
-                upload_results.append({
-                    "filename": file.filename,
-                    "status": "error",
-                    "message": "Unsupported file type"
-                })
-                continue
-
-            file_path = os.path.join(uploads_folder, f"{current_user.id}_{file.filename}")
-            async with aiofiles.open(file_path, 'wb') as out_file:
-                content = await file.read()
-                await out_file.write(content)
-
             try:
-                res = await rag_system.process_uploaded_file(file_path, ext, current_user.id, db)
-                res["filename"] = file.filename
-                upload_results.append(res)
+                upload_results.append(await enqueue_upload(file, current_user.id, db))
             except Exception as e:
-                logger.error(f"Error processing file {file.filename}: {e}")
+                logger.error(f"Error queueing file {file.filename}: {e}")
                 upload_results.append({
                     "filename": file.filename,
                     "status": "error",
@@ -794,43 +819,185 @@ async def chat(
             raise HTTPException(status_code=400, detail="Query cannot be empty")
 
         user_id = current_user.id
-        kb = rag_system
-        context = kb.get_context_for_query(query, user_id=user_id)
+        kb = await aget_rag_system()
+        search_params = SearchParams(nprobe=nprobe, ef_search=ef_search)
+        docs = await kb.asearch_knowledge_base(query, k=5, user_id=user_id, search_params=search_params)
+        packed = kb.build_context(docs)
+        context = packed.text
+        context_tokens = packed.tokens
 
         if not context:
             answer = "I couldn't find relevant information in your documents. Please upload documents or rephrase your question."
             sources = []
         else:
-            prompt_template = f"""
-You are a medical AI assistant with access to the user's uploaded medical documents below.
-
-Context:
-{context}
-
-User question:
-{query}
-
-Please provide an accurate and concise answer based on the above context.
-"""
-            
-            response = model.generate_content(prompt_template)
-            answer = clean_markdown(response.text.strip())
-
-
-            # Provide source document snippets for transparency
-            source_docs = kb.search_knowledge_base(query, k=3, user_id=user_id)
-            sources = [
-                {
-                    "filename": d.metadata.get("file_path", "Unknown").split('/')[-1],
-                    "chunk_index": d.metadata.get("chunk_index", 0),
-                    "content_preview": d.page_content[:200] + "..."
-                }
-                for d in source_docs
-            ]
+            context_hash, question_vector = await answer_cache_key(kb, query, docs)
+            answer = answer_cache.get("chat", user_id, query, context_hash, question_vector)
+            if answer is None:
+                prompt_template = build_chat_prompt(context, query)
+                try:
+                    answer = clean_markdown(await llm_gateway.generate(prompt_template, user_id=user_id))
+                except LLMTimeoutError as e:
+                    raise HTTPException(status_code=504, detail=str(e))
+                if answer:
+                    answer_cache.put("chat", user_id, query, context_hash, answer, question_vector)
+
+            # Provide source document snippets for transparency; the top 3 of the context search
+            sources = source_snippets(docs[:3])
 
     return {
         "upload_results": upload_results if upload_results else None,
         "query": query,
         "answer": answer,
-        "sources": sources
+        "sources": sources,
+        "context_tokens": context_tokens
     }
+
+
+# Streaming (Server-Sent Events) variants of /triage and /chat
+def sse_event(event: str, data: Any) -> str:
+    return f"event: {event}\ndata: {json.dumps(jsonable_encoder(data))}\n\n"
+
+
+def sse_response(events) -> StreamingResponse:
+    return StreamingResponse(
+        events,
+        media_type="text/event-stream",
+        # Stop proxies from buffering the stream, which would defeat the point
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+async def stream_llm_text(prompt: str, user_id: int, parts: List[str]):
+    """Yield cleaned ``token`` events from the model, collecting the text in ``parts``."""
+    cleaner = MarkdownStreamCleaner()
+    async with aclosing(llm_gateway.stream(prompt, user_id=user_id)) as chunks:
+        async for chunk in chunks:
+            text = cleaner.feed(chunk)
+            if text:
+                parts.append(text)
+                yield sse_event("token", {"text": text})
+    tail = cleaner.flush()
+    if tail:
+        parts.append(tail)
+        yield sse_event("token", {"text": tail})
+
+
+async def stream_final_assessment(sess_id: str, session: TriageSession, user_id: int, message: str):
+    await message_log.write(TriageWrite(sess_id, user_id, messages=[("user", message, session.stage.value)]))
+
+    parts: List[str] = []
+    try:
+        prompt = await build_assessment_prompt(session)
+        async for event in stream_llm_text(prompt, user_id, parts):
+            yield event
+        assessment = "".join(parts).strip()
+    except Exception as e:
+        logger.error(f"Error streaming medical assessment: {e}")
+        session.completed = True
+        assessment = ASSESSMENT_FALLBACK
+        yield sse_event("error", {"text": assessment})
+
+    # Persisted once the whole assessment is known
+    turn = TriageWrite(sess_id, user_id, messages=[("bot", assessment, session.stage.value)])
+    turn.session_fields.update(stage=session.stage.value, completed=session.completed, final_assessment=assessment)
+    if session.completed:
+        turn.session_fields["completed_at"] = datetime.now()
+    await message_log.write(turn)
+    await session_store.asave(sess_id, session)
+
+    total_stages = len(TriageStage) - 2
+    current_stage_num = list(TriageStage).index(session.stage) + 1
+    yield sse_event("done", ChatResponse(
+        session_id=sess_id,
+        reply=assessment,
+        finished=session.completed,
+        stage=session.stage.value,
+        progress=f"Step {current_stage_num}/{total_stages}",
+        extracted_info={
+            "data_collected": session.data,
+            "red_flags": session.red_flags_detected,
+            "timestamp": session.created_at.isoformat()
+        }
+    ))
+
+
+@router.post("/triage/stream")
+async def medical_triage_stream(
+    req: ChatRequest,
+    current_user: DBUser = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """/triage as Server-Sent Events: ``token`` events while the final assessment is generated, then ``done``.
+
+    Every other stage answers instantly, so it is sent as a single ``token`` event.
+    """
+    session = await load_triage_session(db, req.session_id, current_user.id) if req.session_id else None
+    message = req.message.strip()
+    matched = {hit.category for hit in keyword_matcher.scan(message)}
+    streams_assessment = (
+        session is not None
+        and session.stage == TriageStage.FINAL_ASSESSMENT
+        and not session.completed
+        and not matched & {"restart", "red_flags"}
+    )
+
+    if streams_assessment:
+        session.data["user_id"] = current_user.id
+        return sse_response(stream_final_assessment(req.session_id, session, current_user.id, message))
+
+    response = await medical_triage(req, current_user, db)
+
+    async def single_reply():
+        yield sse_event("token", {"text": response.reply})
+        yield sse_event("done", response)
+
+    return sse_response(single_reply())
+
+
+@router.post("/chat/stream")
+async def chat_stream(
+    query: str = Form(...),
+    nprobe: Optional[int] = Form(None),
+    ef_search: Optional[int] = Form(None),
+    current_user: DBUser = Depends(get_current_active_user),
+):
+    """/chat as Server-Sent Events: ``sources`` first, ``token`` events while generating, then ``done``.
+
+    Files are not accepted here; upload them through /upload.
+    """
+    if not query.strip():
+        raise HTTPException(status_code=400, detail="Query cannot be empty")
+
+    user_id = current_user.id
+    kb = await aget_rag_system()
+    search_params = SearchParams(nprobe=nprobe, ef_search=ef_search)
+    docs = await kb.asearch_knowledge_base(query, k=5, user_id=user_id, search_params=search_params)
+    packed = kb.build_context(docs)
+    context = packed.text
+    sources = source_snippets(docs[:3]) if context else []
+    context_hash, question_vector = await answer_cache_key(kb, query, docs)
+    cached = answer_cache.get("chat", user_id, query, context_hash, question_vector) if context else None
+
+    async def events():
+        yield sse_event("sources", sources)
+        if not context:
+            answer = "I couldn't find relevant information in your documents. Please upload documents or rephrase your question."
+            yield sse_event("token", {"text": answer})
+        elif cached is not None:
+            answer = cached
+            yield sse_event("token", {"text": answer})
+        else:
+            parts: List[str] = []
+            try:
+                async for event in stream_llm_text(build_chat_prompt(context, query), user_id, parts):
+                    yield event
+            except Exception as e:
+                logger.error(f"Error streaming chat answer: {e}")
+                yield sse_event("error", {"detail": str(e)})
+                return
+            answer = "".join(parts).strip()
+            if answer:
+                answer_cache.put("chat", user_id, query, context_hash, answer, question_vector)
+        yield sse_event("done", {"query": query, "answer": answer, "sources": sources, "context_tokens": packed.tokens})
+
+    return sse_response(events())
@@ -0,0 +1,206 @@
+"""Choose which retrieved chunks go into the prompt.
+
+The splitter overlaps neighbouring chunks by 200 characters, so a plain top-k
+often holds the same passage twice. Candidates are therefore:
+
+1. dropped when their text repeats a candidate that ranks higher
+2. picked by maximal marginal relevance (MMR) over the vectors already in
+   the index, so the final k cover different parts of the user's documents
+3. merged when picked chunks are consecutive chunks of the same document,
+   with the overlapping text kept once
+
+Only picked chunks are merged, and a run is capped at ``max_run`` chunks
+around its best-scoring one, so a passage never grows so long that the
+context packer cuts off the chunk that matched. Merging can leave fewer
+than k passages.
+"""
+import logging
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Dict, List, Optional, Sequence
+
+import numpy as np
+
+if TYPE_CHECKING:
+    from langchain_core.documents import Document
+
+logger = logging.getLogger(__name__)
+
+# Longest overlap searched for between neighbouring chunks; the splitter uses 200
+MAX_OVERLAP = 400
+_MIN_OVERLAP = 20
+# Three 1000-character chunks fit the default 750-token context budget
+MAX_RUN = 3
+
+
+@dataclass
+class Candidate:
+    doc: "Document"
+    relevance: float
+    vector: np.ndarray
+
+
+def overlap_length(before: str, after: str, max_overlap: int = MAX_OVERLAP) -> int:
+    """Length of the longest suffix of ``before`` that is also a prefix of ``after``."""
+    tail = before[-max_overlap:]
+    probe = after[:_MIN_OVERLAP]
+    if len(probe) < _MIN_OVERLAP:
+        return 0
+    start = tail.find(probe)
+    while start != -1:
+        if after.startswith(tail[start:]):
+            return len(tail) - start
+        start = tail.find(probe, start + 1)
+    return 0
+
+
+def _run_key(doc: "Document"):
+    metadata = doc.metadata
+    return metadata.get("document_id") or metadata.get("file_path")
+
+
+def merge_adjacent(candidates: List[Candidate], max_run: int = MAX_RUN) -> List[Candidate]:
+    """Join consecutive chunks of the same document into one candidate, trimming the overlap.
+
+    Runs longer than ``max_run`` are split, keeping the best-scoring chunk's window whole.
+    """
+    from langchain_core.documents import Document
+
+    runs: Dict[object, List[Candidate]] = {}
+    singles: List[Candidate] = []
+    for candidate in candidates:
+        key = _run_key(candidate.doc)
+        if key is None or candidate.doc.metadata.get("chunk_index") is None:
+            singles.append(candidate)
+        else:
+            runs.setdefault(key, []).append(candidate)
+
+    merged = list(singles)
+    for run in runs.values():
+        run.sort(key=lambda candidate: candidate.doc.metadata["chunk_index"])
+        group = [run[0]]
+        for candidate in run[1:]:
+            if candidate.doc.metadata["chunk_index"] == group[-1].doc.metadata["chunk_index"] + 1:
+                group.append(candidate)
+            else:
+                merged.extend(_join(window, Document) for window in _windows(group, max_run))
+                group = [candidate]
+        merged.extend(_join(window, Document) for window in _windows(group, max_run))
+
+    merged.sort(key=lambda candidate: candidate.relevance, reverse=True)
+    return merged
+
+
+def _windows(group: List[Candidate], max_run: int) -> List[List[Candidate]]:
+    """Split a run into pieces of at most ``max_run``, centring one on the best-scoring chunk."""
+    if not group:
+        return []
+    if len(group) <= max_run:
+        return [group]
+    best = max(range(len(group)), key=lambda i: group[i].relevance)
+    start = min(max(best - (max_run - 1) // 2, 0), len(group) - max_run)
+    end = start + max_run
+    return [*_windows(group[:start], max_run), group[start:end], *_windows(group[end:], max_run)]
+
+
+def _join(group: List[Candidate], document_class) -> Candidate:
+    if len(group) == 1:
+        return group[0]
+    text = group[0].doc.page_content
+    for candidate in group[1:]:
+        content = candidate.doc.page_content
+        text += content[overlap_length(text, content):]
+    first = group[0].doc
+    metadata = {
+        **first.metadata,
+        "chunk_indices": [candidate.doc.metadata["chunk_index"] for candidate in group],
+    }
+    vector = np.mean([candidate.vector for candidate in group], axis=0)
+    return Candidate(
+        doc=document_class(page_content=text, metadata=metadata, id=first.id),
+        relevance=max(candidate.relevance for candidate in group),
+        vector=vector / (np.linalg.norm(vector) or 1.0),
+    )
+
+
+def drop_duplicates(candidates: List[Candidate]) -> List[Candidate]:
+    """Drop candidates whose text is contained in a higher-ranked one."""
+    kept: List[Candidate] = []
+    kept_texts: List[str] = []
+    for candidate in candidates:
+        text = " ".join(candidate.doc.page_content.split())
+        if any(text in other for other in kept_texts):
+            continue
+        kept.append(candidate)
+        kept_texts.append(text)
+    return kept
+
+
+def mmr(relevance: np.ndarray, vectors: np.ndarray, k: int, mmr_lambda: float = 0.7) -> List[int]:
+    """Greedy maximal marginal relevance; ``vectors`` must be L2-normalized rows."""
+    n = len(relevance)
+    if n <= k:
+        return [int(i) for i in np.argsort(-relevance)]
+    similarity = vectors @ vectors.T
+    selected: List[int] = []
+    # Highest similarity of each candidate to anything selected so far
+    redundancy = np.full(n, -np.inf, dtype=np.float32)
+    available = np.ones(n, dtype=bool)
+    for _ in range(k):
+        penalty = np.where(np.isfinite(redundancy), redundancy, 0.0)
+        score = mmr_lambda * relevance - (1 - mmr_lambda) * penalty
+        score[~available] = -np.inf
+        best = int(np.argmax(score))
+        selected.append(best)
+        available[best] = False
+        redundancy = np.maximum(redundancy, similarity[best])
+    return selected
+
+
+def _normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def _min_max(scores: np.ndarray) -> np.ndarray:
+    spread = scores.max() - scores.min()
+    return (scores - scores.min()) / spread if spread else np.ones_like(scores)
+
+
+def select_chunks(
+    docs: Sequence["Document"],
+    vectors: np.ndarray,
+    k: int,
+    scores: Optional[Sequence[float]] = None,
+    query_vector: Optional[np.ndarray] = None,
+    mmr_lambda: float = 0.7,
+    max_run: int = MAX_RUN,
+) -> List["Document"]:
+    """Pick ``k`` of the ranked ``docs`` for the prompt, then merge the picked neighbours.
+
+    Relevance comes from ``scores`` (e.g. fused ranks) when given, otherwise
+    from cosine similarity to ``query_vector``.
+    """
+    if not docs:
+        return []
+    vectors = _normalize_rows(np.asarray(vectors, dtype=np.float32))
+    if scores is not None:
+        relevance = np.asarray(scores, dtype=np.float32)
+    elif query_vector is not None:
+        query = np.asarray(query_vector, dtype=np.float32)
+        relevance = vectors @ (query / (np.linalg.norm(query) or 1.0))
+    else:
+        relevance = -np.arange(len(docs), dtype=np.float32)
+    relevance = _min_max(relevance)
+
+    candidates = [Candidate(doc, float(rel), vector) for doc, rel, vector in zip(docs, relevance, vectors)]
+    # Ranked first, so drop_duplicates keeps the higher-ranked copy
+    candidates = drop_duplicates(sorted(candidates, key=lambda candidate: candidate.relevance, reverse=True))
+    chosen = mmr(
+        np.array([candidate.relevance for candidate in candidates], dtype=np.float32),
+        np.vstack([candidate.vector for candidate in candidates]),
+        k,
+        mmr_lambda,
+    )
+    # Only what was picked is merged, so a small corpus does not collapse into one passage per document
+    return [candidate.doc for candidate in merge_adjacent([candidates[i] for i in chosen], max_run)]
@@ -0,0 +1,98 @@
+"""Pack retrieved chunks into a prompt context of a fixed token budget.
+
+Chunks are taken in relevance order until the budget (``CONTEXT_TOKEN_BUDGET``,
+default 750 tokens) is full; the chunk that does not fit is cut back to
+whole sentences. Tokens are counted with tiktoken's ``CONTEXT_TOKEN_ENCODING``
+(default ``cl100k_base``) as a stand-in for the Gemini tokenizer. If the
+encoding cannot be loaded (it is downloaded on first use), a 4-characters-
+per-token estimate is used instead.
+"""
+import os
+import re
+import logging
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import TYPE_CHECKING, List, Optional, Sequence
+
+if TYPE_CHECKING:
+    from langchain_core.documents import Document
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "750"))
+
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+|\n+")
+
+
+@dataclass
+class PackedContext:
+    text: str
+    tokens: int
+    chunks_used: int
+    truncated: bool = False
+
+
+@lru_cache(maxsize=1)
+def _encoding():
+    try:
+        import tiktoken
+
+        return tiktoken.get_encoding(os.getenv("CONTEXT_TOKEN_ENCODING", "cl100k_base"))
+    except Exception as e:
+        logger.warning(f"tiktoken encoding unavailable, estimating tokens from length: {e}")
+        return None
+
+
+def count_tokens(text: str) -> int:
+    encoding = _encoding()
+    if encoding is None:
+        return (len(text) + 3) // 4
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def _fit_sentences(text: str, budget: int) -> str:
+    """The longest run of leading sentences of ``text`` within ``budget`` tokens."""
+    kept: List[str] = []
+    used = 0
+    for sentence in _SENTENCE_END.split(text):
+        sentence = sentence.strip()
+        if not sentence:
+            continue
+        tokens = count_tokens(sentence) + (1 if kept else 0)
+        if used + tokens > budget:
+            break
+        kept.append(sentence)
+        used += tokens
+    return " ".join(kept)
+
+
+def pack_context(
+    docs: Sequence["Document"], max_tokens: Optional[int] = None, separator: str = "\n\n"
+) -> PackedContext:
+    """Join ``docs`` (most relevant first) into at most ``max_tokens`` tokens."""
+    budget = max_tokens or DEFAULT_TOKEN_BUDGET
+    separator_tokens = count_tokens(separator)
+    parts: List[str] = []
+    used = 0
+    truncated = False
+    for doc in docs:
+        content = doc.page_content.strip()
+        if not content:
+            continue
+        cost = count_tokens(content) + (separator_tokens if parts else 0)
+        if used + cost <= budget:
+            parts.append(content)
+            used += cost
+            continue
+        # Cut the chunk that overflows at a sentence boundary and stop there
+        truncated = True
+        remaining = budget - used - (separator_tokens if parts else 0)
+        if remaining > 0:
+            partial = _fit_sentences(content, remaining)
+            if partial:
+                parts.append(partial)
+        break
+
+    text = separator.join(parts)
+    return PackedContext(text=text, tokens=count_tokens(text) if text else 0,
+                         chunks_used=len(parts), truncated=truncated)
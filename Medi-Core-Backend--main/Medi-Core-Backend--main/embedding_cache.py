@@ -0,0 +1,160 @@
+"""Content-addressed cache for embedding vectors.
+
+Vectors are keyed by ``(model_id, sha256(text))`` and kept in two tiers: an
+in-memory LRU in front of a SQLite file on disk. ``CachedEmbeddings`` wraps any
+embedding backend so only text that has never been seen is sent to the model.
+"""
+import asyncio
+import hashlib
+import logging
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+logger = logging.getLogger(__name__)
+
+
+def text_digest(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """Two-tier (memory LRU + SQLite) store of float32 vectors."""
+
+    def __init__(self, db_path: str = "embedding_cache.db", max_memory_items: int = 20000):
+        self.db_path = db_path
+        self.max_memory_items = max_memory_items
+        self._memory: "OrderedDict[tuple, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " model_id TEXT NOT NULL,"
+            " text_hash TEXT NOT NULL,"
+            " vector BLOB NOT NULL,"
+            " PRIMARY KEY (model_id, text_hash))"
+        )
+        self._conn.commit()
+
+    def _remember(self, key: tuple, vector: np.ndarray) -> None:
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_items:
+            self._memory.popitem(last=False)
+
+    def get_many(self, model_id: str, digests: Sequence[str]) -> Dict[str, np.ndarray]:
+        """Return cached vectors for whichever digests are known."""
+        found: Dict[str, np.ndarray] = {}
+        with self._lock:
+            pending = []
+            for digest in digests:
+                key = (model_id, digest)
+                vector = self._memory.get(key)
+                if vector is not None:
+                    self._memory.move_to_end(key)
+                    found[digest] = vector
+                    self.memory_hits += 1
+                else:
+                    pending.append(digest)
+
+            # SQLite caps bound parameters, so look up in slices
+            for start in range(0, len(pending), 500):
+                batch = pending[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT text_hash, vector FROM embeddings WHERE model_id = ? AND text_hash IN ({placeholders})",
+                    (model_id, *batch),
+                ).fetchall()
+                for digest, blob in rows:
+                    vector = np.frombuffer(blob, dtype=np.float32)
+                    found[digest] = vector
+                    self._remember((model_id, digest), vector)
+                    self.disk_hits += 1
+
+            self.misses += len(pending) - sum(1 for digest in pending if digest in found)
+        return found
+
+    def put_many(self, model_id: str, items: Dict[str, np.ndarray]) -> None:
+        if not items:
+            return
+        with self._lock:
+            rows = []
+            for digest, vector in items.items():
+                vector = np.ascontiguousarray(vector, dtype=np.float32)
+                self._remember((model_id, digest), vector)
+                rows.append((model_id, digest, vector.tobytes()))
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model_id, text_hash, vector) VALUES (?, ?, ?)", rows
+            )
+            self._conn.commit()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            hits = self.memory_hits + self.disk_hits
+            return {
+                "hits": hits,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "memory_items": len(self._memory),
+            }
+
+
+class CachedEmbeddings(Embeddings):
+    """Wraps an embedding backend so vectors for known text come from the cache."""
+
+    def __init__(self, backend: Embeddings, cache: EmbeddingCache, model_id: Optional[str] = None):
+        self.backend = backend
+        self.cache = cache
+        self.model_id = model_id or getattr(backend, "model_id", type(backend).__name__)
+
+    def _lookup(self, texts: List[str]):
+        digests = [text_digest(text) for text in texts]
+        found = self.cache.get_many(self.model_id, list(dict.fromkeys(digests)))
+        # Each unseen text is embedded once even if it appears several times in the batch
+        missing = list(dict.fromkeys(d for d in digests if d not in found))
+        first_text = {}
+        for digest, text in zip(digests, texts):
+            first_text.setdefault(digest, text)
+        return digests, found, missing, [first_text[d] for d in missing]
+
+    def _store(self, found, missing, vectors) -> None:
+        computed = {digest: np.asarray(vector, dtype=np.float32) for digest, vector in zip(missing, vectors)}
+        self.cache.put_many(self.model_id, computed)
+        found.update(computed)
+
+    def embed_documents(self, texts: List[str]) -> np.ndarray:
+        if not texts:
+            return np.empty((0, 0), dtype=np.float32)
+        digests, found, missing, missing_texts = self._lookup(texts)
+        if missing_texts:
+            self._store(found, missing, self.backend.embed_documents(missing_texts))
+        return np.vstack([found[digest] for digest in digests])
+
+    async def aembed_documents(self, texts: List[str]) -> np.ndarray:
+        if not texts:
+            return np.empty((0, 0), dtype=np.float32)
+        # The SQLite lookups and writes run in a thread so they never block the event loop
+        digests, found, missing, missing_texts = await asyncio.to_thread(self._lookup, texts)
+        if missing_texts:
+            vectors = await self.backend.aembed_documents(missing_texts)
+            await asyncio.to_thread(self._store, found, missing, vectors)
+        return np.vstack([found[digest] for digest in digests])
+
+    def embed_query(self, text: str) -> np.ndarray:
+        return self.embed_documents([text])[0]
+
+    async def aembed_query(self, text: str) -> np.ndarray:
+        return (await self.aembed_documents([text]))[0]
+
+    def stats(self) -> Dict[str, int]:
+        return self.cache.stats()
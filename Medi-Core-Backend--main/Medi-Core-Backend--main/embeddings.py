@@ -0,0 +1,228 @@
+"""Embedding backends for the medical knowledge base.
+
+``create_embeddings`` picks the backend from ``EMBEDDING_BACKEND``:
+
+* ``hf_api`` (default) - remote Hugging Face inference API
+* ``local`` - all-MiniLM-L6-v2 running in-process on CPU
+* ``local_onnx`` - the same model through ONNX Runtime with int8 weights
+
+Unless ``EMBEDDING_CACHE_PATH`` is set to an empty string, the backend is
+wrapped in a persistent embedding cache stored at that path.
+"""
+import os
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+
+import numpy as np
+from dotenv import load_dotenv
+from langchain_core.embeddings import Embeddings
+from huggingface_hub import InferenceClient, AsyncInferenceClient
+
+from embedding_cache import CachedEmbeddings, EmbeddingCache
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+DEFAULT_MODEL_ID = "sentence-transformers/all-MiniLM-L6-v2"
+# int8 export shipped in the model repo; pick the variant matching the CPU via EMBEDDING_ONNX_FILE
+DEFAULT_ONNX_FILE = "onnx/model_quint8_avx2.onnx"
+
+
+class HFInferenceEmbeddings(Embeddings):
+    """Embeddings served by the Hugging Face inference API.
+
+    Inputs are split into batches bounded by item count and total characters,
+    several batches are in flight at once over a single client, and each batch
+    is retried with exponential backoff before the whole call fails.
+    """
+
+    def __init__(
+        self,
+        model_id=DEFAULT_MODEL_ID,
+        batch_size: int = 32,
+        max_batch_chars: int = 16000,
+        max_concurrency: int = 4,
+        max_retries: int = 3,
+        backoff_seconds: float = 0.5,
+        timeout: float = 30.0,
+    ):
+        token = os.getenv("HUGGINGFACE_API_TOKEN")
+        if not token:
+            raise EnvironmentError("HUGGINGFACE_API_TOKEN not found in environment variables.")
+        self.client = InferenceClient(token=token, timeout=timeout)
+        self.async_client = AsyncInferenceClient(token=token, timeout=timeout)
+        self.model_id = model_id
+        self.batch_size = batch_size
+        self.max_batch_chars = max_batch_chars
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="hf-embed")
+
+    def _batches(self, texts: List[str]) -> List[List[str]]:
+        batches, current, current_chars = [], [], 0
+        for text in texts:
+            if current and (len(current) >= self.batch_size or current_chars + len(text) > self.max_batch_chars):
+                batches.append(current)
+                current, current_chars = [], 0
+            current.append(text)
+            current_chars += len(text)
+        if current:
+            batches.append(current)
+        return batches
+
+    @staticmethod
+    def _to_matrix(result, expected_rows: int) -> np.ndarray:
+        matrix = np.asarray(result, dtype=np.float32)
+        if matrix.ndim == 1:
+            matrix = matrix.reshape(1, -1)
+        elif matrix.ndim == 3:
+            # Token-level output: mean-pool into one vector per text
+            matrix = matrix.mean(axis=1)
+        if matrix.shape[0] != expected_rows:
+            raise ValueError(f"Expected {expected_rows} embeddings, got {matrix.shape[0]}")
+        return matrix
+
+    def _embed_batch(self, batch: List[str]) -> np.ndarray:
+        for attempt in range(self.max_retries + 1):
+            try:
+                result = self.client.feature_extraction(batch, model=self.model_id)
+                return self._to_matrix(result, len(batch))
+            except Exception as e:
+                if attempt == self.max_retries:
+                    logger.error(f"Error embedding batch of {len(batch)} texts: {e}")
+                    raise
+                delay = self.backoff_seconds * (2 ** attempt)
+                logger.warning(f"Embedding batch failed ({e}); retrying in {delay:.1f}s")
+                time.sleep(delay)
+
+    async def _aembed_batch(self, batch: List[str], semaphore: asyncio.Semaphore) -> np.ndarray:
+        async with semaphore:
+            for attempt in range(self.max_retries + 1):
+                try:
+                    result = await self.async_client.feature_extraction(batch, model=self.model_id)
+                    return self._to_matrix(result, len(batch))
+                except Exception as e:
+                    if attempt == self.max_retries:
+                        logger.error(f"Error embedding batch of {len(batch)} texts: {e}")
+                        raise
+                    delay = self.backoff_seconds * (2 ** attempt)
+                    logger.warning(f"Embedding batch failed ({e}); retrying in {delay:.1f}s")
+                    await asyncio.sleep(delay)
+
+    def embed_documents(self, texts: List[str]) -> np.ndarray:
+        if not texts:
+            return np.empty((0, 0), dtype=np.float32)
+        batches = self._batches(texts)
+        if len(batches) == 1:
+            return self._embed_batch(batches[0])
+        return np.vstack(list(self._executor.map(self._embed_batch, batches)))
+
+    async def aembed_documents(self, texts: List[str]) -> np.ndarray:
+        if not texts:
+            return np.empty((0, 0), dtype=np.float32)
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        results = await asyncio.gather(*(self._aembed_batch(batch, semaphore) for batch in self._batches(texts)))
+        return np.vstack(results)
+
+    def embed_query(self, text: str) -> np.ndarray:
+        return self._embed_batch([text])[0]
+
+    async def aembed_query(self, text: str) -> np.ndarray:
+        matrix = await self._aembed_batch([text], asyncio.Semaphore(1))
+        return matrix[0]
+
+    def __call__(self, texts):
+        """
+        This makes the instance callable to be used by vectorstores like FAISS.
+        It accepts either a single string or list of strings.
+        """
+        if isinstance(texts, str):
+            # Single text example
+            return self.embed_query(texts)
+        elif isinstance(texts, list):
+            # List of texts example
+            return self.embed_documents(texts)
+        else:
+            raise ValueError("Input must be a string or list of strings")
+
+
+class LocalEmbeddings(Embeddings):
+    """all-MiniLM-L6-v2 running in-process on CPU through sentence-transformers.
+
+    With ``quantized=True`` the int8 ONNX export is served by ONNX Runtime.
+    Async calls run on a dedicated thread pool so encoding never blocks the
+    event loop.
+    """
+
+    def __init__(
+        self,
+        model_id: str = DEFAULT_MODEL_ID,
+        quantized: bool = False,
+        onnx_file: Optional[str] = None,
+        device: str = "cpu",
+        batch_size: int = 32,
+        max_workers: int = 2,
+    ):
+        from sentence_transformers import SentenceTransformer
+
+        if quantized:
+            self.model = SentenceTransformer(
+                model_id,
+                device=device,
+                backend="onnx",
+                model_kwargs={"file_name": onnx_file or DEFAULT_ONNX_FILE},
+            )
+        else:
+            self.model = SentenceTransformer(model_id, device=device)
+        self.model_id = model_id
+        self.quantized = quantized
+        self.batch_size = batch_size
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="local-embed")
+
+    def embed_documents(self, texts: List[str]) -> np.ndarray:
+        if not texts:
+            return np.empty((0, 0), dtype=np.float32)
+        vectors = self.model.encode(
+            texts, batch_size=self.batch_size, convert_to_numpy=True, show_progress_bar=False
+        )
+        return np.asarray(vectors, dtype=np.float32)
+
+    def embed_query(self, text: str) -> np.ndarray:
+        return self.embed_documents([text])[0]
+
+    async def aembed_documents(self, texts: List[str]) -> np.ndarray:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self.embed_documents, texts)
+
+    async def aembed_query(self, text: str) -> np.ndarray:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self.embed_query, text)
+
+
+def create_embeddings(backend: Optional[str] = None) -> Embeddings:
+    """Build the embedding backend named by ``backend`` or ``EMBEDDING_BACKEND``."""
+    backend = (backend or os.getenv("EMBEDDING_BACKEND", "hf_api")).lower()
+    model_id = os.getenv("EMBEDDING_MODEL_ID", DEFAULT_MODEL_ID)
+
+    if backend == "hf_api":
+        embeddings = HFInferenceEmbeddings(model_id=model_id)
+        cache_model_id = model_id
+    elif backend == "local":
+        embeddings = LocalEmbeddings(model_id=model_id)
+        cache_model_id = model_id
+    elif backend == "local_onnx":
+        embeddings = LocalEmbeddings(model_id=model_id, quantized=True, onnx_file=os.getenv("EMBEDDING_ONNX_FILE"))
+        # Quantized vectors differ slightly, so they get their own cache namespace
+        cache_model_id = f"{model_id}:onnx-int8"
+    else:
+        raise ValueError(f"Unknown embedding backend: {backend}")
+
+    cache_path = os.getenv("EMBEDDING_CACHE_PATH", "embedding_cache.db")
+    if not cache_path:
+        return embeddings
+    return CachedEmbeddings(embeddings, EmbeddingCache(cache_path), model_id=cache_model_id)
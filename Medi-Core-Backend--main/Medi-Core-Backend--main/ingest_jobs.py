@@ -0,0 +1,214 @@
+"""Background ingestion jobs for uploaded documents.
+
+``/upload`` and ``/chat`` save the file, create a ``DocumentStore`` row in the
+``pending`` state and return its id as the job id straight away. A pool of
+asyncio workers then runs the streaming ingestion pipeline, moving the row
+through ``processing`` to ``ready`` or ``failed``; live progress is served by
+``GET /ingest-jobs/{job_id}``. Rows still pending or processing when the
+server stops are queued again on the next startup. ``DELETE /documents``
+marks a row ``deleting`` before removing it, which stops its ingestion.
+"""
+import os
+import asyncio
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import List, Optional
+from uuid import uuid4
+
+import aiofiles
+from fastapi import UploadFile
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import SessionLocal, DocumentStore
+from ingestion import IngestionProgress, SUPPORTED_FILE_TYPES
+
+logger = logging.getLogger(__name__)
+
+UPLOADS_FOLDER = "uploads"
+
+
+@dataclass
+class IngestJob:
+    job_id: int  # the DocumentStore id of the file being ingested
+    user_id: int
+    filename: str
+    file_path: str
+    file_type: str
+    status: str = "pending"
+    progress: IngestionProgress = field(default_factory=IngestionProgress)
+    error: Optional[str] = None
+    created_at: datetime = field(default_factory=datetime.now)
+    finished_at: Optional[datetime] = None
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.job_id,
+            "document_id": self.job_id,
+            "filename": self.filename,
+            "status": self.status,
+            "pages_parsed": self.progress.pages_parsed,
+            "chunks_embedded": self.progress.chunks_embedded,
+            "error": self.error,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class IngestJobQueue:
+    """In-process worker pool that ingests uploaded files in the background."""
+
+    def __init__(self, workers: int = 2, max_finished_jobs: int = 1000):
+        self.workers = workers
+        self.max_finished_jobs = max_finished_jobs
+        self._jobs: "OrderedDict[int, IngestJob]" = OrderedDict()
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+
+    async def start(self) -> None:
+        self._queue = asyncio.Queue()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        jobs = await asyncio.to_thread(self._unfinished_jobs)
+        for job in jobs:
+            self.submit(job)
+        if jobs:
+            logger.info(f"Re-queued {len(jobs)} unfinished ingestion jobs")
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def submit(self, job: IngestJob) -> IngestJob:
+        self._jobs[job.job_id] = job
+        self._queue.put_nowait(job.job_id)
+        self._forget_finished()
+        return job
+
+    def get(self, job_id: int) -> Optional[IngestJob]:
+        return self._jobs.get(job_id)
+
+    def _forget_finished(self) -> None:
+        finished = [job_id for job_id, job in self._jobs.items() if job.finished_at is not None]
+        for job_id in finished[:max(0, len(finished) - self.max_finished_jobs)]:
+            del self._jobs[job_id]
+
+    @staticmethod
+    def _unfinished_jobs() -> List[IngestJob]:
+        db = SessionLocal()
+        try:
+            rows = db.query(DocumentStore).filter(DocumentStore.status.in_(("pending", "processing"))).all()
+            return [
+                IngestJob(
+                    job_id=row.id,
+                    user_id=row.user_id,
+                    filename=row.filename,
+                    file_path=row.file_path,
+                    file_type=row.file_type,
+                )
+                for row in rows
+            ]
+        finally:
+            db.close()
+
+    async def _worker(self) -> None:
+        while True:
+            job_id = await self._queue.get()
+            try:
+                job = self._jobs.get(job_id)
+                if job is not None:
+                    await self._run(job)
+            except Exception as e:
+                logger.error(f"Ingestion job {job_id} crashed: {e}")
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, job: IngestJob) -> None:
+        from rag_system import aget_rag_system
+
+        job.status = "processing"
+        # A sync session: process_uploaded_file runs every query on it in a worker thread
+        db = SessionLocal()
+        try:
+            rag_system = await aget_rag_system()
+            result = await rag_system.process_uploaded_file(
+                job.file_path, job.file_type, job.user_id, db,
+                progress=job.progress, document_id=job.job_id,
+            )
+        except Exception as e:
+            result = {"status": "error", "message": str(e)}
+        finally:
+            await asyncio.to_thread(db.close)
+
+        if result.get("status") == "success":
+            job.status = "ready"
+        else:
+            job.status = "failed"
+            job.error = result.get("message")
+        job.finished_at = datetime.now()
+        logger.info(f"Ingestion job {job.job_id} ({job.filename}) finished: {job.status}")
+
+
+ingest_queue = IngestJobQueue(workers=int(os.getenv("INGEST_WORKERS", "2")))
+
+
+async def enqueue_upload(file: UploadFile, user_id: int, db: AsyncSession) -> dict:
+    """Save an uploaded file, record it as pending and queue it for ingestion."""
+    ext = file.filename.split(".")[-1].lower()
+    if ext not in SUPPORTED_FILE_TYPES:
+        return {"filename": file.filename, "status": "error", "message": "Unsupported file type"}
+
+    os.makedirs(UPLOADS_FOLDER, exist_ok=True)
+    # Unique per upload: re-uploading a filename must not overwrite a file a queued job still reads
+    file_path = os.path.join(UPLOADS_FOLDER, f"{user_id}_{uuid4().hex}_{file.filename}")
+    async with aiofiles.open(file_path, "wb") as out_file:
+        while chunk := await file.read(1024 * 1024):
+            await out_file.write(chunk)
+
+    doc_record = DocumentStore(
+        user_id=user_id,
+        filename=file.filename,
+        file_type=ext,
+        file_path=file_path,
+        chunk_count=0,
+        status="pending",
+    )
+    db.add(doc_record)
+    await db.commit()
+
+    job = ingest_queue.submit(IngestJob(
+        job_id=doc_record.id,
+        user_id=user_id,
+        filename=file.filename,
+        file_path=file_path,
+        file_type=ext,
+    ))
+    return job.to_dict()
+
+
+async def get_job_status(job_id: int, user_id: int, db: AsyncSession) -> Optional[dict]:
+    """Live progress for queued jobs, falling back to the DocumentStore row."""
+    job = ingest_queue.get(job_id)
+    if job is not None:
+        return job.to_dict() if job.user_id == user_id else None
+
+    row = await db.scalar(select(DocumentStore).where(
+        DocumentStore.id == job_id,
+        DocumentStore.user_id == user_id
+    ))
+    if row is None:
+        return None
+    return {
+        "job_id": row.id,
+        "document_id": row.id,
+        "filename": row.filename,
+        "status": row.status,
+        "pages_parsed": None,
+        "chunks_embedded": row.chunk_count,
+        "error": row.error,
+        "created_at": None,
+        "finished_at": row.processed_at,
+    }
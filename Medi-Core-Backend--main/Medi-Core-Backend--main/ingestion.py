@@ -0,0 +1,92 @@
+"""Streaming document ingestion: load -> split -> embed -> index.
+
+Pages are pulled one at a time from the loader's ``lazy_load`` in a worker
+thread, split into chunks and handed over in fixed-size batches through a
+bounded queue. The loader can only run ``max_pending_batches`` ahead of
+embedding and indexing, so peak memory stays flat however large the file is.
+"""
+import asyncio
+import logging
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, AsyncIterator, Iterator, List, Optional
+
+if TYPE_CHECKING:
+    from langchain_core.documents import Document
+
+logger = logging.getLogger(__name__)
+
+SUPPORTED_FILE_TYPES = ("pdf", "docx", "doc", "txt", "xlsx", "xls")
+
+
+def get_loader_class(file_type: str):
+    """Return the LangChain loader for ``file_type``, or None if unsupported."""
+    from langchain_community.document_loaders import (
+        PyPDFLoader, Docx2txtLoader, TextLoader, UnstructuredExcelLoader
+    )
+
+    loader_map = {
+        "pdf": PyPDFLoader,
+        "docx": Docx2txtLoader,
+        "doc": Docx2txtLoader,
+        "txt": TextLoader,
+        "xlsx": UnstructuredExcelLoader,
+        "xls": UnstructuredExcelLoader,
+    }
+    return loader_map.get(file_type.lower())
+
+
+@dataclass
+class IngestionProgress:
+    pages_parsed: int = 0
+    chunks_embedded: int = 0
+
+
+async def iter_chunk_batches(
+    loader,
+    text_splitter,
+    batch_size: int = 64,
+    max_pending_batches: int = 2,
+    progress: Optional[IngestionProgress] = None,
+) -> AsyncIterator[List["Document"]]:
+    """Yield chunk batches of at most ``batch_size`` while the loader streams pages."""
+    queue: asyncio.Queue = asyncio.Queue(maxsize=max_pending_batches)
+    finished = object()
+    pages: Iterator["Document"] = loader.lazy_load()
+
+    def next_page_chunks() -> Optional[List["Document"]]:
+        page = next(pages, None)
+        if page is None:
+            return None
+        return text_splitter.split_documents([page])
+
+    async def produce():
+        pending: List["Document"] = []
+        try:
+            while True:
+                chunks = await asyncio.to_thread(next_page_chunks)
+                if chunks is None:
+                    break
+                if progress is not None:
+                    progress.pages_parsed += 1
+                pending.extend(chunks)
+                while len(pending) >= batch_size:
+                    # Blocks while the consumer is behind - this is the backpressure
+                    await queue.put(pending[:batch_size])
+                    pending = pending[batch_size:]
+            if pending:
+                await queue.put(pending)
+            await queue.put(finished)
+        except Exception as e:
+            await queue.put(e)
+
+    producer = asyncio.create_task(produce())
+    try:
+        while True:
+            item = await queue.get()
+            if item is finished:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        producer.cancel()
@@ -0,0 +1,114 @@
+"""Single-pass keyword scanning for triage messages.
+
+The red-flag, restart and symptom keyword sets are read from
+``triage_keywords.json`` (or ``TRIAGE_KEYWORDS_PATH``) and compiled into one
+regular expression. One scan of a message reports every hit in every set
+with its position, including keywords nested inside longer ones ("chest
+pain" inside "crushing chest pain").
+
+Keywords only match whole words, so "fit" no longer fires on "benefit" or
+"fitness", and any run of whitespace matches the spaces inside a phrase.
+Plurals and other inflections that must still count ("seizures",
+"blindness") are listed as keywords of their own in the JSON file.
+"""
+import os
+import re
+import json
+import logging
+from typing import Dict, List, NamedTuple, Sequence
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_KEYWORDS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "triage_keywords.json")
+
+
+class KeywordHit(NamedTuple):
+    category: str
+    keyword: str
+    start: int
+    end: int
+
+
+def _phrase_pattern(keyword: str) -> str:
+    return r"\s+".join(re.escape(word) for word in keyword.split())
+
+
+def _trie_pattern(keywords: Sequence[str]) -> str:
+    """One alternation with shared prefixes factored out, so each position is tried in a single pass.
+
+    Optional tails are greedy, so the longest keyword that ends on a word
+    boundary wins.
+    """
+    trie: Dict[str, dict] = {}
+    for keyword in keywords:
+        node = trie
+        for char in keyword:
+            node = node.setdefault(char, {})
+        node[""] = {}
+
+    def build(node: Dict[str, dict]) -> str:
+        branches = [
+            (r"\s+" if char == " " else re.escape(char)) + build(child)
+            for char, child in sorted(node.items()) if char
+        ]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        return f"(?:{body})?" if "" in node else body
+
+    return build(trie)
+
+
+class KeywordMatcher:
+    """All keyword sets compiled into one case-insensitive, word-bounded pattern."""
+
+    def __init__(self, keyword_sets: Dict[str, Sequence[str]]):
+        self.keyword_sets = {category: list(keywords) for category, keywords in keyword_sets.items()}
+        self._categories: Dict[str, List[str]] = {}
+        for category, keywords in self.keyword_sets.items():
+            for keyword in keywords:
+                key = " ".join(keyword.lower().split())
+                categories = self._categories.setdefault(key, [])
+                if category not in categories:
+                    categories.append(category)
+
+        keywords = list(self._categories)
+        # A lookahead so overlapping keywords ("chest pain" / "pain") are all found
+        self._pattern = re.compile(r"(?<!\w)(?=(" + _trie_pattern(keywords) + r")(?!\w))", re.IGNORECASE)
+        self._phrases = {k: re.compile(_phrase_pattern(k) + r"(?!\w)", re.IGNORECASE) for k in keywords}
+        # Shorter keywords that start a longer one at a word boundary ("chest pain" / "chest pain with ...")
+        self._prefixes = {
+            k: [p for p in keywords if p != k and k.startswith(p + " ")]
+            for k in keywords
+        }
+
+    @classmethod
+    def from_file(cls, path: str) -> "KeywordMatcher":
+        with open(path, "r", encoding="utf-8") as f:
+            return cls(json.load(f))
+
+    def scan(self, text: str) -> List[KeywordHit]:
+        """Every keyword hit in ``text``, ordered by position."""
+        hits: List[KeywordHit] = []
+        for match in self._pattern.finditer(text):
+            start = match.start(1)
+            keyword = " ".join(match.group(1).lower().split())
+            spans = [(keyword, match.end(1))]
+            for prefix in self._prefixes[keyword]:
+                prefix_match = self._phrases[prefix].match(text, start)
+                if prefix_match:
+                    spans.append((prefix, prefix_match.end()))
+            for found, end in spans:
+                for category in self._categories[found]:
+                    hits.append(KeywordHit(category, found, start, end))
+        return hits
+
+    def has(self, text: str, category: str) -> bool:
+        return any(hit.category == category for hit in self.scan(text))
+
+    def find(self, text: str, category: str) -> List[str]:
+        """Distinct keywords of ``category`` in ``text``, in order of appearance."""
+        return list(dict.fromkeys(hit.keyword for hit in self.scan(text) if hit.category == category))
+
+
+keyword_matcher = KeywordMatcher.from_file(os.getenv("TRIAGE_KEYWORDS_PATH", DEFAULT_KEYWORDS_PATH))
@@ -0,0 +1,219 @@
+"""Per-user BM25 inverted indexes for exact-term retrieval.
+
+Embeddings blur the exact drug names, lab codes and dosages that medical
+questions hinge on, so every chunk is also indexed lexically. Each user's
+index is a SQLite file next to their FAISS partition::
+
+    user_<id>/bm25.sqlite    chunks(chunk_id, document_id, length)
+                             postings(term, chunk_id, tf)
+                             meta(n_chunks, total_length)
+
+Chunks are added batch by batch during ingestion and a document's rows are
+deleted with it. Partitions that predate the lexical index are backfilled
+from the vector store when their file is first created.
+"""
+import os
+import re
+import math
+import heapq
+import logging
+import sqlite3
+import threading
+from collections import Counter, OrderedDict
+from typing import TYPE_CHECKING, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+if TYPE_CHECKING:
+    from langchain_core.documents import Document
+
+logger = logging.getLogger(__name__)
+
+BM25_FILE = "bm25.sqlite"
+
+# Keeps "500mg", "0.5", "hba1c" and "icd-10" as single terms
+_TOKEN = re.compile(r"[a-z0-9]+(?:[.\-/][a-z0-9]+)*")
+
+_STOPWORDS = frozenset(
+    "a an and are as at be by for from has have in is it its of on or that the this to was were will with".split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    return [token for token in _TOKEN.findall(text.lower()) if token not in _STOPWORDS]
+
+
+class BM25Index:
+    """One user's inverted index, stored in SQLite."""
+
+    def __init__(self, db_path: str, k1: float = 1.5, b: float = 0.75):
+        self.db_path = db_path
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(
+            "CREATE TABLE IF NOT EXISTS chunks ("
+            " chunk_id TEXT PRIMARY KEY, document_id INTEGER, length INTEGER NOT NULL);"
+            "CREATE INDEX IF NOT EXISTS chunks_document ON chunks (document_id);"
+            "CREATE TABLE IF NOT EXISTS postings ("
+            " term TEXT NOT NULL, chunk_id TEXT NOT NULL, tf INTEGER NOT NULL,"
+            " PRIMARY KEY (term, chunk_id)) WITHOUT ROWID;"
+            "CREATE INDEX IF NOT EXISTS postings_chunk ON postings (chunk_id);"
+            "CREATE TABLE IF NOT EXISTS meta (id INTEGER PRIMARY KEY CHECK (id = 0),"
+            " n_chunks INTEGER NOT NULL, total_length INTEGER NOT NULL);"
+            "INSERT OR IGNORE INTO meta VALUES (0, 0, 0);"
+        )
+        self._conn.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT n_chunks FROM meta").fetchone()[0]
+
+    def _remove(self, chunk_ids: Sequence[str]) -> None:
+        """Delete chunks and their postings; caller holds the lock and commits."""
+        for start in range(0, len(chunk_ids), 500):
+            batch = list(chunk_ids[start:start + 500])
+            placeholders = ",".join("?" * len(batch))
+            removed, removed_length = self._conn.execute(
+                f"SELECT COUNT(*), COALESCE(SUM(length), 0) FROM chunks WHERE chunk_id IN ({placeholders})", batch
+            ).fetchone()
+            if not removed:
+                continue
+            self._conn.execute(f"DELETE FROM postings WHERE chunk_id IN ({placeholders})", batch)
+            self._conn.execute(f"DELETE FROM chunks WHERE chunk_id IN ({placeholders})", batch)
+            self._conn.execute(
+                "UPDATE meta SET n_chunks = n_chunks - ?, total_length = total_length - ?",
+                (removed, removed_length),
+            )
+
+    def add(self, chunk_ids: Sequence[str], documents: Sequence["Document"]) -> None:
+        chunk_rows, posting_rows, total_length = [], [], 0
+        for chunk_id, doc in zip(chunk_ids, documents):
+            terms = Counter(tokenize(doc.page_content))
+            length = sum(terms.values())
+            total_length += length
+            chunk_rows.append((chunk_id, doc.metadata.get("document_id"), length))
+            posting_rows.extend((term, chunk_id, tf) for term, tf in terms.items())
+
+        with self._lock:
+            # Re-adding a chunk replaces it, so re-ingestion and backfill are idempotent
+            self._remove(chunk_ids)
+            self._conn.executemany("INSERT INTO chunks VALUES (?, ?, ?)", chunk_rows)
+            self._conn.executemany("INSERT INTO postings VALUES (?, ?, ?)", posting_rows)
+            self._conn.execute(
+                "UPDATE meta SET n_chunks = n_chunks + ?, total_length = total_length + ?",
+                (len(chunk_rows), total_length),
+            )
+            self._conn.commit()
+
+    def delete_document(self, document_id: int) -> int:
+        with self._lock:
+            chunk_ids = [
+                row[0] for row in
+                self._conn.execute("SELECT chunk_id FROM chunks WHERE document_id = ?", (document_id,))
+            ]
+            self._remove(chunk_ids)
+            self._conn.commit()
+        return len(chunk_ids)
+
+    def search(self, query: str, k: int = 5) -> List[Tuple[str, float]]:
+        """Top ``k`` (chunk_id, BM25 score) pairs for ``query``."""
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms or k <= 0:
+            return []
+        placeholders = ",".join("?" * len(terms))
+        with self._lock:
+            n_chunks, total_length = self._conn.execute("SELECT n_chunks, total_length FROM meta").fetchone()
+            rows = self._conn.execute(
+                "SELECT p.term, p.chunk_id, p.tf, c.length FROM postings p JOIN chunks c USING (chunk_id)"
+                f" WHERE p.term IN ({placeholders})",
+                terms,
+            ).fetchall()
+        if not n_chunks:
+            return []
+
+        avg_length = total_length / n_chunks or 1.0
+        document_frequency = Counter(term for term, _, _, _ in rows)
+        scores: Dict[str, float] = {}
+        for term, chunk_id, tf, length in rows:
+            df = document_frequency[term]
+            idf = math.log(1 + (n_chunks - df + 0.5) / (df + 0.5))
+            norm = tf + self.k1 * (1 - self.b + self.b * length / avg_length)
+            scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * tf * (self.k1 + 1) / norm
+        return heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+
+
+class LexicalIndexManager:
+    """Opens each user's BM25 index on demand, keeping a bounded number open."""
+
+    def __init__(
+        self,
+        root_path: str,
+        backfill_source: Optional[Callable[[int], Iterable[Tuple[str, "Document"]]]] = None,
+        max_open: int = 64,
+    ):
+        self.root_path = root_path
+        self.backfill_source = backfill_source
+        self.max_open = max_open
+        self._indexes: "OrderedDict[int, BM25Index]" = OrderedDict()
+        self._lock = threading.RLock()
+
+    def get(self, user_id: int, create: bool = True) -> Optional[BM25Index]:
+        with self._lock:
+            index = self._indexes.get(user_id)
+            if index is not None:
+                self._indexes.move_to_end(user_id)
+                return index
+
+            tenant_path = os.path.join(self.root_path, f"user_{user_id}")
+            db_path = os.path.join(tenant_path, BM25_FILE)
+            is_new = not os.path.exists(db_path)
+            if is_new and not create:
+                return None
+            os.makedirs(tenant_path, exist_ok=True)
+            index = BM25Index(db_path)
+            if is_new and self.backfill_source is not None:
+                self._backfill(user_id, index)
+
+            self._indexes[user_id] = index
+            while len(self._indexes) > self.max_open:
+                _, evicted = self._indexes.popitem(last=False)
+                evicted.close()
+            return index
+
+    def _backfill(self, user_id: int, index: BM25Index) -> None:
+        rows = list(self.backfill_source(user_id))
+        for start in range(0, len(rows), 1000):
+            batch = rows[start:start + 1000]
+            index.add([chunk_id for chunk_id, _ in batch], [doc for _, doc in batch])
+        if rows:
+            logger.info(f"Backfilled BM25 index for user_id={user_id} with {len(rows)} chunks")
+
+    def add(self, user_id: int, chunk_ids: Sequence[str], documents: Sequence["Document"]) -> None:
+        self.get(user_id).add(chunk_ids, documents)
+
+    def delete_document(self, user_id: int, document_id: int) -> int:
+        index = self.get(user_id, create=False)
+        return index.delete_document(document_id) if index is not None else 0
+
+    def search(self, user_id: int, query: str, k: int = 5) -> List[Tuple[str, float]]:
+        return self.get(user_id).search(query, k)
+
+    def close(self) -> None:
+        with self._lock:
+            for index in self._indexes.values():
+                index.close()
+            self._indexes.clear()
+
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[str]], k: int = 60) -> List[Tuple[str, float]]:
+    """Merge ranked id lists; each id scores sum(1 / (k + rank)) over the lists it appears in."""
+    scores: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking, start=1):
+            scores[item] = scores.get(item, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
@@ -0,0 +1,148 @@
+"""Async gateway to the Gemini model.
+
+Every LLM call from the request handlers goes through ``llm_gateway`` so that
+generation never blocks the event loop and cannot starve other requests:
+
+* a global semaphore caps in-flight calls (``LLM_MAX_CONCURRENCY``)
+* a per-user semaphore stops one user from taking every slot
+  (``LLM_PER_USER_CONCURRENCY``)
+* each call has a deadline covering the wait for a slot and the generation
+  itself (``LLM_TIMEOUT_SECONDS``); on expiry the call is cancelled and
+  ``LLMTimeoutError`` is raised
+
+``stream`` yields text as it is generated for the SSE endpoints; the slots are
+held until the stream is exhausted or closed.
+"""
+import os
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from functools import lru_cache
+from typing import AsyncIterator, Awaitable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+MODEL_NAME = "gemini-2.0-flash-exp"
+
+
+class LLMTimeoutError(Exception):
+    """The model did not answer before the call's deadline."""
+
+
+@lru_cache(maxsize=1)
+def get_model():
+    """Build the Gemini client on first use; the SDK is slow to import."""
+    import google.generativeai as genai
+
+    api_key = os.getenv("GOOGLE_API_KEY")
+    if not api_key:
+        raise ValueError("GOOGLE_API_KEY environment variable not set")
+
+    genai.configure(api_key=api_key)
+    return genai.GenerativeModel(MODEL_NAME)
+
+
+class LLMGateway:
+    """Runs model calls under global and per-user concurrency limits with deadlines."""
+
+    def __init__(self, max_concurrency: int = 8, per_user_concurrency: int = 2, timeout: float = 60.0):
+        self.max_concurrency = max_concurrency
+        self.per_user_concurrency = per_user_concurrency
+        self.timeout = timeout
+        self._global: Optional[asyncio.Semaphore] = None
+        self._per_user: Dict[int, asyncio.Semaphore] = {}
+        self._per_user_holders: Dict[int, int] = {}
+
+    def _global_semaphore(self) -> asyncio.Semaphore:
+        # Created lazily so it binds to the running event loop
+        if self._global is None:
+            self._global = asyncio.Semaphore(self.max_concurrency)
+        return self._global
+
+    def _acquire_user(self, user_id: int) -> asyncio.Semaphore:
+        semaphore = self._per_user.get(user_id)
+        if semaphore is None:
+            semaphore = self._per_user[user_id] = asyncio.Semaphore(self.per_user_concurrency)
+        self._per_user_holders[user_id] = self._per_user_holders.get(user_id, 0) + 1
+        return semaphore
+
+    def _release_user(self, user_id: int) -> None:
+        # Drop the semaphore once nobody holds or waits on it, so the dict does not grow per user
+        self._per_user_holders[user_id] -= 1
+        if not self._per_user_holders[user_id]:
+            del self._per_user_holders[user_id]
+            del self._per_user[user_id]
+
+    @asynccontextmanager
+    async def _slot(self, user_id: Optional[int], deadline: float):
+        """Hold a per-user and a global slot, waiting no later than ``deadline``."""
+        user_semaphore = self._acquire_user(user_id) if user_id is not None else None
+        try:
+            if user_semaphore is not None:
+                await _until(user_semaphore.acquire(), deadline)
+            try:
+                await _until(self._global_semaphore().acquire(), deadline)
+                try:
+                    yield
+                finally:
+                    self._global_semaphore().release()
+            finally:
+                if user_semaphore is not None:
+                    user_semaphore.release()
+        finally:
+            if user_semaphore is not None:
+                self._release_user(user_id)
+
+    def _deadline(self, timeout: Optional[float]) -> float:
+        return asyncio.get_running_loop().time() + (timeout or self.timeout)
+
+    async def generate(self, prompt: str, user_id: Optional[int] = None, timeout: Optional[float] = None) -> str:
+        """Generate a reply to ``prompt``; raises LLMTimeoutError past the deadline."""
+        deadline = self._deadline(timeout)
+        try:
+            async with self._slot(user_id, deadline):
+                response = await _until(get_model().generate_content_async(prompt), deadline)
+                return response.text.strip()
+        except LLMTimeoutError:
+            logger.warning(f"LLM call for user_id={user_id} cancelled at its deadline")
+            raise
+
+    async def stream(
+        self, prompt: str, user_id: Optional[int] = None, timeout: Optional[float] = None
+    ) -> AsyncIterator[str]:
+        """Yield text chunks as the model produces them, under the same limits and deadline."""
+        deadline = self._deadline(timeout)
+        try:
+            async with self._slot(user_id, deadline):
+                response = await _until(get_model().generate_content_async(prompt, stream=True), deadline)
+                chunks = response.__aiter__()
+                while True:
+                    try:
+                        chunk = await _until(chunks.__anext__(), deadline)
+                    except StopAsyncIteration:
+                        break
+                    if chunk.text:
+                        yield chunk.text
+        except LLMTimeoutError:
+            logger.warning(f"LLM stream for user_id={user_id} cancelled at its deadline")
+            raise
+
+
+async def _until(awaitable: Awaitable, deadline: float):
+    """Await ``awaitable``, cancelling it and raising LLMTimeoutError at ``deadline``."""
+    remaining = deadline - asyncio.get_running_loop().time()
+    if remaining <= 0:
+        if asyncio.iscoroutine(awaitable):
+            awaitable.close()
+        raise LLMTimeoutError("LLM call ran past its deadline")
+    try:
+        return await asyncio.wait_for(awaitable, remaining)
+    except asyncio.TimeoutError:
+        raise LLMTimeoutError("LLM call ran past its deadline")
+
+
+llm_gateway = LLMGateway(
+    max_concurrency=int(os.getenv("LLM_MAX_CONCURRENCY", "8")),
+    per_user_concurrency=int(os.getenv("LLM_PER_USER_CONCURRENCY", "2")),
+    timeout=float(os.getenv("LLM_TIMEOUT_SECONDS", "60")),
+)
@@ -1,20 +1,27 @@
-from fastapi import FastAPI, Depends, HTTPException, status
+from fastapi import FastAPI, Depends, HTTPException, Query, status
 from fastapi.security import OAuth2PasswordRequestForm
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy.orm import Session
-from datetime import timedelta
+from sqlalchemy import select, func, or_, and_
+from sqlalchemy.ext.asyncio import AsyncSession
+import base64
+from datetime import datetime, timedelta
 from dotenv import load_dotenv
 from fastapi import FastAPI, Depends, HTTPException, status, UploadFile, File, Form
-from typing import List
+from typing import List, Optional
 import os
-import aiofiles
-from rag_system import rag_system
-import google.generativeai as genai
+import asyncio
+from rag_system import aget_rag_system, get_rag_system, rag_system_loaded
 from database import DocumentStore, get_db
-import google.generativeai as genai
 from fastapi import Depends, HTTPException, UploadFile, File, Form
-from database import create_tables, get_db, User as DBUser, ChatSession, ChatMessage
+from database import async_engine, write_queue, create_tables, get_db, User as DBUser, ChatSession, ChatMessage
 from chatbot import router as chatbot_router
+from ingest_jobs import ingest_queue
+from llm_gateway import get_model
+from answer_cache import answer_cache
+from context_packing import count_tokens
+from red_flag_detector import get_red_flag_detector
+from session_store import session_store
+from message_log import message_log
 from auth.auth_handler import (
     authenticate_user, create_access_token, get_current_active_user,
     create_user, update_user_profile, get_user_by_email,
@@ -41,11 +48,56 @@ logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
 app.include_router(chatbot_router, prefix="", tags=["medical-chatbot"])
 
+# Filled in by warm_up(); /ready reports it
+readiness = {"ready": False, "warming_up": False, "errors": {}}
+
+
+def warm_up() -> None:
+    """Build the RAG engine, run one embedding and create the Gemini client.
+
+    Everything here is otherwise built lazily by the first request that needs it.
+    """
+    readiness["warming_up"] = True
+    readiness["errors"] = {}
+    steps = {
+        "rag_system": get_rag_system,
+        "embeddings": lambda: get_rag_system().embeddings.embed_query("warm-up"),
+        "llm": get_model,
+        "tokenizer": lambda: count_tokens("warm-up"),
+        "red_flags": get_red_flag_detector,
+    }
+    for name, step in steps.items():
+        try:
+            step()
+        except Exception as e:
+            logger.error(f"Warm-up step {name} failed: {e}")
+            readiness["errors"][name] = str(e)
+    readiness["ready"] = "rag_system" not in readiness["errors"]
+    readiness["warming_up"] = False
+
+
 # Create database tables on startup
 @app.on_event("startup")
-def startup_event():
+async def startup_event():
     create_tables()
     print("✅ Database tables created successfully")
+    await ingest_queue.start()
+    await message_log.start()
+    if os.getenv("WARMUP_ON_STARTUP", "true").lower() == "true":
+        # Serve traffic straight away; /ready flips once the heavy parts are loaded
+        asyncio.get_running_loop().run_in_executor(None, warm_up)
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await ingest_queue.stop()
+    # Commit any triage writes still queued
+    await message_log.stop()
+    if rag_system_loaded():
+        # Fold any unmerged upload segments into their base snapshots
+        get_rag_system().tenant_indexes.merge_pending()
+    session_store.close()
+    write_queue.close()
+    await async_engine.dispose()
 
 # Include chatbot router
 app.include_router(chatbot_router, prefix="", tags=["medical-chatbot"])
@@ -54,20 +106,48 @@ app.include_router(chatbot_router, prefix="", tags=["medical-chatbot"])
 async def root():
     return {"message": "Welcome to FastAPI Medical Triage Backend with Database"}
 
+@app.get("/ready")
+async def ready():
+    """Readiness probe: 503 until the warm-up has loaded the RAG engine."""
+    if not readiness["ready"]:
+        raise HTTPException(status_code=503, detail=readiness)
+    return readiness
+
+@app.post("/warm-up")
+async def trigger_warm_up():
+    """Run the warm-up now, e.g. when WARMUP_ON_STARTUP is disabled."""
+    await asyncio.to_thread(warm_up)
+    return readiness
+
+@app.get("/embedding-cache/stats")
+async def embedding_cache_stats():
+    """Hit/miss counters of the embedding cache."""
+    if not rag_system_loaded():
+        return {"enabled": None, "loaded": False}
+    stats = getattr(get_rag_system().embeddings, "stats", None)
+    if stats is None:
+        return {"enabled": False}
+    return {"enabled": True, **stats()}
+
+@app.get("/answer-cache/stats")
+async def answer_cache_stats():
+    """Hit/miss counters of the /ask and /chat answer cache."""
+    return {"semantic": answer_cache.semantic, **answer_cache.stats()}
+
 @app.post("/register", response_model=dict)
-async def register(user: UserCreate, db: Session = Depends(get_db)):
+async def register(user: UserCreate, db: AsyncSession = Depends(get_db)):
     """User registration endpoint with database storage."""
-    existing_user = get_user_by_email(db, user.email)
+    existing_user = await get_user_by_email(db, user.email)
     if existing_user:
         raise HTTPException(status_code=400, detail="Email already registered")
     
-    new_user = create_user(db, user)
+    new_user = await create_user(db, user)
     return {"message": "User registered successfully", "user_id": new_user.id}
 
 @app.post("/login", response_model=Token)
-async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
+async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_db)):
     """User login endpoint."""
-    user = authenticate_user(db, form_data.username, form_data.password)
+    user = await authenticate_user(db, form_data.username, form_data.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -90,54 +170,153 @@ async def get_profile(current_user: DBUser = Depends(get_current_active_user)):
 async def update_profile(
     user_update: UserUpdate,
     current_user: DBUser = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Update user profile."""
-    updated_user = update_user_profile(db, current_user.id, user_update)
+    updated_user = await update_user_profile(db, current_user.id, user_update)
     if not updated_user:
         raise HTTPException(status_code=404, detail="User not found")
     return updated_user
 
+def encode_history_cursor(session: ChatSession) -> str:
+    """Opaque position after ``session`` in the newest-first history."""
+    raw = f"{session.created_at.isoformat()}|{session.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_history_cursor(cursor: str):
+    try:
+        created_at, session_pk = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(created_at), int(session_pk)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def message_to_dict(msg: ChatMessage) -> dict:
+    return {
+        "message_type": msg.message_type,
+        "content": msg.content,
+        "stage": msg.stage,
+        "timestamp": msg.timestamp
+    }
+
 @app.get("/chat-history")
 async def get_chat_history(
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None,
+    summary: bool = False,
     current_user: DBUser = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    """Get user's chat history."""
-    sessions = db.query(ChatSession).filter(ChatSession.user_id == current_user.id).order_by(ChatSession.created_at.desc()).all()
-    
+    """Get user's chat history, newest first, ``limit`` sessions per page.
+
+    Pass the returned ``next_cursor`` back as ``cursor`` for the next page. With
+    ``summary=true`` only session metadata and message counts are returned; the
+    full transcript of one session is at ``/chat-history/{session_id}``.
+    """
+    query = select(ChatSession).where(ChatSession.user_id == current_user.id)
+    if cursor:
+        created_at, session_pk = decode_history_cursor(cursor)
+        query = query.where(or_(
+            ChatSession.created_at < created_at,
+            and_(ChatSession.created_at == created_at, ChatSession.id < session_pk),
+        ))
+    # One row past the page tells whether there is a next one
+    sessions = (await db.scalars(
+        query.order_by(ChatSession.created_at.desc(), ChatSession.id.desc()).limit(limit + 1)
+    )).all()
+    has_more = len(sessions) > limit
+    sessions = sessions[:limit]
+    session_ids = [session.session_id for session in sessions]
+
+    # Counts (summary) or messages (full) for the whole page in one query
+    messages_by_session = {session_id: [] for session_id in session_ids}
+    if summary:
+        counts = dict((await db.execute(
+            select(ChatMessage.session_id, func.count(ChatMessage.id))
+            .where(ChatMessage.session_id.in_(session_ids))
+            .group_by(ChatMessage.session_id)
+        )).all()) if session_ids else {}
+    else:
+        if session_ids:
+            messages = await db.scalars(
+                select(ChatMessage).where(ChatMessage.session_id.in_(session_ids))
+                .order_by(ChatMessage.timestamp.asc(), ChatMessage.id.asc())
+            )
+            for msg in messages:
+                messages_by_session[msg.session_id].append(msg)
+        counts = {session_id: len(msgs) for session_id, msgs in messages_by_session.items()}
+
     chat_history = []
     for session in sessions:
-        messages = db.query(ChatMessage).filter(ChatMessage.session_id == session.session_id).order_by(ChatMessage.timestamp.asc()).all()
-        chat_history.append({
+        entry = {
             "session_id": session.session_id,
             "created_at": session.created_at,
+            "stage": session.stage,
             "completed": session.completed,
             "emergency_detected": session.emergency_detected,
-            "final_assessment": session.final_assessment,
             "main_symptoms": session.main_symptoms,
-            "messages_count": len(messages),
-            "messages": [
-                {
-                    "message_type": msg.message_type,
-                    "content": msg.content,
-                    "stage": msg.stage,
-                    "timestamp": msg.timestamp
-                } for msg in messages
-            ]
-        })
-    
-    return {"chat_history": chat_history, "total_sessions": len(chat_history)}
+            "messages_count": counts.get(session.session_id, 0),
+        }
+        if not summary:
+            entry["final_assessment"] = session.final_assessment
+            entry["messages"] = [message_to_dict(msg) for msg in messages_by_session[session.session_id]]
+        chat_history.append(entry)
+
+    total_sessions = await db.scalar(
+        select(func.count(ChatSession.id)).where(ChatSession.user_id == current_user.id)
+    )
+    return {
+        "chat_history": chat_history,
+        "total_sessions": total_sessions,
+        "next_cursor": encode_history_cursor(sessions[-1]) if has_more else None
+    }
+
+@app.get("/chat-history/{session_id}")
+async def get_chat_transcript(
+    session_id: str,
+    current_user: DBUser = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """Full transcript of one of the user's triage sessions."""
+    session = await db.scalar(select(ChatSession).where(
+        ChatSession.session_id == session_id,
+        ChatSession.user_id == current_user.id
+    ))
+    if not session:
+        raise HTTPException(status_code=404, detail="Chat session not found")
+
+    messages = (await db.scalars(
+        select(ChatMessage).where(ChatMessage.session_id == session_id)
+        .order_by(ChatMessage.timestamp.asc(), ChatMessage.id.asc())
+    )).all()
+    return {
+        "session_id": session.session_id,
+        "created_at": session.created_at,
+        "completed_at": session.completed_at,
+        "stage": session.stage,
+        "completed": session.completed,
+        "emergency_detected": session.emergency_detected,
+        "age": session.age,
+        "sex": session.sex,
+        "medical_history": session.medical_history,
+        "main_symptoms": session.main_symptoms,
+        "symptom_details": session.symptom_details,
+        "associated_symptoms": session.associated_symptoms,
+        "final_assessment": session.final_assessment,
+        "messages_count": len(messages),
+        "messages": [message_to_dict(msg) for msg in messages]
+    }
 
 @app.get("/my-documents")
 async def get_my_documents(
     current_user: DBUser = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Get user's uploaded documents."""
-    documents = db.query(DocumentStore).filter(
-        DocumentStore.user_id == current_user.id
-    ).order_by(DocumentStore.processed_at.desc()).all()
+    documents = (await db.scalars(
+        select(DocumentStore).where(
+            DocumentStore.user_id == current_user.id
+        ).order_by(DocumentStore.processed_at.desc())
+    )).all()
     
     return {
         "documents": [
@@ -146,6 +325,7 @@ async def get_my_documents(
                 "filename": doc.filename,
                 "file_type": doc.file_type,
                 "chunk_count": doc.chunk_count,
+                "status": doc.status,
                 "processed_at": doc.processed_at
             }
             for doc in documents
@@ -158,33 +338,44 @@ async def get_my_documents(
 async def delete_document(
     document_id: int,
     current_user: DBUser = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Delete a document from user's knowledge base."""
     
-    document = db.query(DocumentStore).filter(
+    document = await db.scalar(select(DocumentStore).where(
         DocumentStore.id == document_id,
         DocumentStore.user_id == current_user.id
-    ).first()
+    ))
     
     if not document:
         raise HTTPException(status_code=404, detail="Document not found")
     
     try:
+        document_id, file_path = document.id, document.file_path
+
+        # Marked first: an ingestion still running for this document checks the row
+        # before every batch and stops once it is deleting. If tombstoning fails the
+        # row stays in this state, so the delete can be retried.
+        document.status = "deleting"
+        await db.commit()
+
+        # Tombstone the chunks so they stop showing up in searches right away;
+        # they are physically removed by the index's background compaction
+        rag_system = await aget_rag_system()
+        removed_chunks = await asyncio.to_thread(
+            rag_system.delete_document, current_user.id, document_id, file_path=file_path
+        )
+
         # Remove file from filesystem
-        if os.path.exists(document.file_path):
-            os.remove(document.file_path)
+        if await asyncio.to_thread(os.path.exists, file_path):
+            await asyncio.to_thread(os.remove, file_path)
         
         # Remove from database
-        db.delete(document)
-        db.commit()
-        
-        # Note: Removing from FAISS vector store is complex
-        # For now, we'll rebuild the vector store periodically
-        # or implement a more sophisticated approach
-        
-        return {"message": "Document deleted successfully"}
+        await db.delete(document)
+        await db.commit()
+
+        return {"message": "Document deleted successfully", "chunks_removed": removed_chunks}
         
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail=f"Error deleting document: {e}")
@@ -0,0 +1,174 @@
+"""Write-behind log for triage conversation writes.
+
+A triage turn writes two ``ChatMessage`` rows, updates its ``ChatSession``
+row (creating it on the first turn) and may fill in blanks on the user's
+profile. Instead of committing all of that on the request path, handlers
+``write`` a ``TriageWrite`` and a background task commits queued writes in
+one transaction every ``MESSAGE_LOG_FLUSH_MS`` milliseconds (default 50), or
+as soon as ``MESSAGE_LOG_MAX_BATCH`` writes (default 200) are waiting.
+
+``write(..., durable=True)`` commits before returning and raises if the
+write could not be committed; the emergency path uses it.
+``MESSAGE_LOG_MODE=sync`` makes every write durable. When a batch fails its
+writes are retried one at a time, so only the writes that fail on their own
+are queued again (up to ``max_attempts`` times). Queued writes are flushed
+when the server shuts down.
+"""
+import os
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+from database import ChatSession, ChatMessage, User, write_queue
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class TriageWrite:
+    session_id: str
+    user_id: int
+    # (message_type, content, stage), in order
+    messages: List[Tuple[str, str, str]] = field(default_factory=list)
+    # ChatSession columns to set; the row is created if it does not exist
+    session_fields: Dict[str, Any] = field(default_factory=dict)
+    # User profile columns, only set where the profile has no value yet
+    user_fields: Dict[str, Any] = field(default_factory=dict)
+    attempts: int = 0
+
+
+class MessageLog:
+    """Queues triage writes and commits them in batches."""
+
+    def __init__(self, flush_interval: float = 0.05, max_batch: int = 200,
+                 always_durable: bool = False, max_attempts: int = 3):
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.always_durable = always_durable
+        self.max_attempts = max_attempts
+        self._pending: List[TriageWrite] = []
+        self._wake: Optional[asyncio.Event] = None
+        self._flush_lock: Optional[asyncio.Lock] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    async def start(self) -> None:
+        self._wake = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+        if self._pending:
+            logger.error(f"Shutting down with {len(self._pending)} triage writes that could not be committed")
+
+    async def write(self, item: TriageWrite, durable: bool = False) -> None:
+        self._pending.append(item)
+        if durable or self.always_durable or self._task is None:
+            for failed, error in await self.flush():
+                if failed is item:
+                    # The caller hears about it, so it is not retried in the background
+                    self._pending = [pending for pending in self._pending if pending is not item]
+                    raise error
+        elif len(self._pending) >= self.max_batch:
+            self._wake.set()
+
+    async def flush(self) -> List[Tuple[TriageWrite, Exception]]:
+        """Commit everything queued so far in one transaction; returns the writes that failed."""
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+        async with self._flush_lock:
+            batch, self._pending = self._pending, []
+            if not batch:
+                return []
+            try:
+                await write_queue.run(self._commit, batch)
+                return []
+            except Exception as e:
+                if len(batch) == 1:
+                    failures = [(batch[0], e)]
+                else:
+                    logger.warning(f"Failed to commit {len(batch)} triage writes together, retrying one by one: {e}")
+                    failures = await self._commit_each(batch)
+
+            retry = []
+            for item, error in failures:
+                item.attempts += 1
+                if item.attempts < self.max_attempts:
+                    retry.append(item)
+                logger.error(
+                    f"Failed to commit triage write for session {item.session_id}"
+                    f" ({'will retry' if item.attempts < self.max_attempts else 'dropped'}): {error}"
+                )
+            self._pending[:0] = retry
+            return failures
+
+    async def _commit_each(self, batch: List[TriageWrite]) -> List[Tuple[TriageWrite, Exception]]:
+        """Commit ``batch`` one write per transaction, so one bad write does not sink the rest."""
+        failures = []
+        for item in batch:
+            try:
+                await write_queue.run(self._commit, [item])
+            except Exception as e:
+                failures.append((item, e))
+        return failures
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            await self.flush()
+
+    @staticmethod
+    def _commit(db, batch: List[TriageWrite]) -> None:
+        """Apply ``batch`` in ``db``; the write queue commits it as one transaction."""
+        session_ids = {item.session_id for item in batch}
+        sessions = {
+            row.session_id: row for row in
+            db.query(ChatSession).filter(ChatSession.session_id.in_(session_ids))
+        }
+        user_ids = {item.user_id for item in batch if item.user_fields}
+        users = {user.id: user for user in db.query(User).filter(User.id.in_(user_ids))} if user_ids else {}
+
+        for item in batch:
+            row = sessions.get(item.session_id)
+            if row is None:
+                row = ChatSession(session_id=item.session_id, user_id=item.user_id,
+                                  stage=item.session_fields.get("stage", "greeting"))
+                db.add(row)
+                sessions[item.session_id] = row
+            elif row.user_id != item.user_id:
+                # Session ids come from clients; never write into another user's conversation
+                logger.error(f"Dropped triage write for session {item.session_id} owned by another user")
+                continue
+            for name, value in item.session_fields.items():
+                setattr(row, name, value)
+
+            user = users.get(item.user_id)
+            for name, value in item.user_fields.items():
+                if user is not None and not getattr(user, name):
+                    setattr(user, name, value)
+
+            db.add_all(
+                ChatMessage(session_id=item.session_id, user_id=item.user_id,
+                            message_type=message_type, content=content, stage=stage)
+                for message_type, content, stage in item.messages
+            )
+
+
+message_log = MessageLog(
+    flush_interval=int(os.getenv("MESSAGE_LOG_FLUSH_MS", "50")) / 1000,
+    max_batch=int(os.getenv("MESSAGE_LOG_MAX_BATCH", "200")),
+    always_durable=os.getenv("MESSAGE_LOG_MODE", "batched").lower() == "sync",
+)
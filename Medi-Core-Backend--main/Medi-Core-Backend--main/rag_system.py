@@ -1,194 +1,380 @@
 import os
 import pickle
 import logging
-from typing import List, Dict, Any, Optional
-from pathlib import Path
+import threading
+from typing import TYPE_CHECKING, List, Dict, Any, Optional, Tuple
 import asyncio
 from datetime import datetime
-import requests
-import pypdf
-from pypdf import PdfReader
-
-import faiss
-import numpy as np
-from langchain_community.document_loaders import (
-    PyPDFLoader, 
-    Docx2txtLoader, 
-    TextLoader,
-    UnstructuredExcelLoader
-)
-from langchain_community.vectorstores import FAISS
-from langchain_community.docstore.in_memory import InMemoryDocstore
-from langchain_huggingface import HuggingFaceEmbeddings
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_core.documents import Document
-from dotenv import load_dotenv
-from langchain.embeddings.base import Embeddings
-from huggingface_hub import InferenceClient, AsyncInferenceClient
-
-
 
+from dotenv import load_dotenv
 
 from sqlalchemy.orm import Session
-from database import DocumentStore, get_db
+from database import DocumentStore
+from ann_index import SearchParams
+from ingestion import IngestionProgress, get_loader_class, iter_chunk_batches
+from answer_cache import answer_cache
+from context_packing import PackedContext, pack_context
+from lexical_index import LexicalIndexManager, reciprocal_rank_fusion
+
+if TYPE_CHECKING:
+    from langchain_core.documents import Document
+    from langchain_core.embeddings import Embeddings
 
 logger = logging.getLogger(__name__)
 
 load_dotenv()
 
-class HFInferenceEmbeddings(Embeddings):
-    def __init__(self, model_id="sentence-transformers/all-MiniLM-L6-v2"):
-        token = os.getenv("HUGGINGFACE_API_TOKEN")
-        if not token:
-            raise EnvironmentError("HUGGINGFACE_API_TOKEN not found in environment variables.")
-        self.client = InferenceClient(token=token)
-        self.model_id = model_id
 
-    def embed_documents(self, texts: List[str]) -> List[List[float]]:
-        try:
-            results = self.client.feature_extraction(texts, model=self.model_id)
-            # The API returns a List[List[float]] compatible with FAISS
-            return results
-        except Exception as e:
-            logger.error(f"Error embedding documents: {e}")
-            return []
-        
-    def embed_query(self, text: str) -> List[float]:
-        try:
-            result = self.client.feature_extraction(text, model=self.model_id)
-            return result
-        except Exception as e:
-            logger.error(f"Error embedding query: {e}")
-            return []
+LEGACY_PICKLE_PATH = "vector_store.pkl"
 
-    def __call__(self, texts):
-        """
-        This makes the instance callable to be used by vectorstores like FAISS.
-        It accepts either a single string or list of strings.
-        """
-        if isinstance(texts, str):
-            # Single text example
-            return self.embed_query(texts)
-        elif isinstance(texts, list):
-            # List of texts example
-            return self.embed_documents(texts)
-        else:
-            raise ValueError("Input must be a string or list of strings")    
 
 class MedicalRAGSystem:
-    def __init__(self, vector_store_path: str = "medical_vector_store"):
+    """The one vector-store engine behind /upload, /chat, /ask and triage knowledge lookups."""
+
+    def __init__(
+        self, vector_store_path: str = "medical_vector_store", embeddings: Optional["Embeddings"] = None,
+        ingest_batch_size: int = 64, hybrid_search: Optional[bool] = None, rrf_k: int = 60,
+        mmr_lambda: Optional[float] = None,
+    ):
+        # Heavy imports live here so importing this module does not pull in FAISS or the splitter
+        from langchain.text_splitter import RecursiveCharacterTextSplitter
+        from vector_index import TenantIndexManager
+        from embeddings import create_embeddings
+
         self.vector_store_path = vector_store_path
-        self.embeddings = HFInferenceEmbeddings()
+        self.ingest_batch_size = ingest_batch_size
+        if hybrid_search is None:
+            hybrid_search = os.getenv("HYBRID_SEARCH", "true").lower() == "true"
+        self.hybrid_search = hybrid_search
+        self.rrf_k = rrf_k
+        self.mmr_lambda = mmr_lambda if mmr_lambda is not None else float(os.getenv("MMR_LAMBDA", "0.7"))
+        self.embeddings = embeddings or create_embeddings()
         self.text_splitter = RecursiveCharacterTextSplitter(
             chunk_size=1000,
             chunk_overlap=200,
             separators=["\n\n", "\n", ". ", " ", ""]
         )
-        self.vector_store = self._load_or_create_vector_store()
+        self.tenant_indexes = TenantIndexManager(os.path.join(vector_store_path, "tenants"), self.embeddings)
+        self.tenant_indexes.recover()
+        # BM25 files live in the same per-user directories as the FAISS partitions
+        self.lexical_indexes = LexicalIndexManager(
+            os.path.join(vector_store_path, "tenants"), backfill_source=self.tenant_indexes.iter_documents
+        )
+        self._migrate_legacy_stores()
 
-    def _load_or_create_vector_store(self) -> FAISS:
-        faiss_file = f"{self.vector_store_path}.faiss"
+    def _migrate_legacy_stores(self) -> None:
+        """Move chunks from the old shared stores into per-user partitions, once."""
+        faiss_file = os.path.join(self.vector_store_path, "index.faiss")
         if os.path.exists(faiss_file):
             try:
-                return FAISS.load_local(self.vector_store_path, self.embeddings)
-            except Exception as e:
-                logger.warning(f"Failed to load vector store: {e}")
+                from langchain_community.vectorstores import FAISS
 
-        # create empty FAISS store
-        sample_embed = self.embeddings.embed_query("sample")
-        if sample_embed is None or (isinstance(sample_embed, np.ndarray) and sample_embed.size == 0):
-            logger.warning("Empty embedding returned for sample query; creating zero-dim index.")
-            dim = 384  # fallback dimension typical for MiniLM models
-        else:
-            dim = len(sample_embed)
+                legacy_store = FAISS.load_local(
+                    self.vector_store_path, self.embeddings, allow_dangerous_deserialization=True
+                )
+                self.tenant_indexes.migrate_from(legacy_store)
+                for name in ("index.faiss", "index.pkl"):
+                    path = os.path.join(self.vector_store_path, name)
+                    if os.path.exists(path):
+                        os.replace(path, path + ".migrated")
+            except Exception as e:
+                logger.warning(f"Failed to migrate shared vector store into per-user indexes: {e}")
 
-        index = faiss.IndexFlatL2(dim)
-        return FAISS(self.embeddings, index, InMemoryDocstore({}), {})
+        # The old /upload endpoint pickled a separate store built with another embedding model
+        if os.path.exists(LEGACY_PICKLE_PATH):
+            try:
+                with open(LEGACY_PICKLE_PATH, "rb") as f:
+                    legacy_store = pickle.load(f)
+                grouped: Dict[int, List["Document"]] = {}
+                for doc in legacy_store.docstore._dict.values():
+                    if doc.metadata.get("user_id") is not None:
+                        grouped.setdefault(doc.metadata["user_id"], []).append(doc)
+                for user_id, docs in grouped.items():
+                    # Vectors from a different model are not comparable, so re-embed the text
+                    self.tenant_indexes.add_documents(user_id, docs)
+                os.replace(LEGACY_PICKLE_PATH, LEGACY_PICKLE_PATH + ".migrated")
+                logger.info(f"Migrated {LEGACY_PICKLE_PATH} for {len(grouped)} users into per-user indexes")
+            except Exception as e:
+                logger.warning(f"Failed to migrate {LEGACY_PICKLE_PATH}: {e}")
 
+    async def process_uploaded_file(
+        self, file_path: str, file_type: str, user_id: int, db: Session,
+        progress: Optional[IngestionProgress] = None, document_id: Optional[int] = None,
+    ) -> dict:
+        """Ingest a file into the user's index.
 
-    async def process_uploaded_file(self, file_path: str, file_type: str, user_id: int, db: Session) -> dict:
-        from langchain_community.document_loaders import (
-            PyPDFLoader, Docx2txtLoader, TextLoader, UnstructuredExcelLoader
-        )
+        ``document_id`` picks up a row created when the upload was queued;
+        otherwise a new ``DocumentStore`` row is created. If the row is
+        deleted while the file is being ingested, ingestion stops and the
+        chunks indexed so far are tombstoned again.
 
-        loader_map = {
-            "pdf": PyPDFLoader,
-            "docx": Docx2txtLoader,
-            "doc": Docx2txtLoader,
-            "txt": TextLoader,
-            "xlsx": UnstructuredExcelLoader,
-            "xls": UnstructuredExcelLoader,
-        }
+        ``db`` is a sync session; every query on it, and every index write,
+        runs in a worker thread so the event loop is never blocked.
+        """
+        from vector_index import DocumentDeletedError
 
-        Loader = loader_map.get(file_type.lower())
+        Loader = get_loader_class(file_type)
+        record_id = await asyncio.to_thread(
+            self._start_ingestion, db, file_path, file_type, user_id, document_id, Loader is not None
+        )
+        if record_id is None:
+            return {"status": "error", "message": f"Document {document_id} not found"}
         if not Loader:
             return {"status": "error", "message": f"Unsupported file type: {file_type}"}
 
+        progress = progress or IngestionProgress()
+        upload_timestamp = datetime.now().isoformat()
+
+        chunk_count = 0
         try:
-            documents = await asyncio.to_thread(Loader(file_path).load)
+            async for chunks in iter_chunk_batches(
+                Loader(file_path), self.text_splitter, batch_size=self.ingest_batch_size, progress=progress
+            ):
+                if not await asyncio.to_thread(self._document_exists, db, record_id):
+                    raise DocumentDeletedError(f"Document {record_id} was deleted during ingestion")
+                for i, chunk in enumerate(chunks, start=chunk_count):
+                    chunk.metadata.update({
+                        "user_id": user_id,
+                        "document_id": record_id,
+                        "file_path": file_path,
+                        "file_type": file_type,
+                        "upload_timestamp": upload_timestamp,
+                        "chunk_index": i
+                    })
+                vectors = await self.embeddings.aembed_documents([chunk.page_content for chunk in chunks])
+                await asyncio.to_thread(
+                    self._index_batch,
+                    user_id, chunks, vectors,
+                    [f"{record_id}:{i}" for i in range(chunk_count, chunk_count + len(chunks))],
+                    chunk_count == 0,
+                )
+                chunk_count += len(chunks)
+                progress.chunks_embedded = chunk_count
+            await asyncio.to_thread(self._finish_ingestion, db, record_id, chunk_count)
         except Exception as e:
-            logger.error(f"Failed loading document: {e}")
-            return {"status": "error", "message": f"Failed to load document: {str(e)}"}
-
-        chunks = self.text_splitter.split_documents(documents)
-        for i, chunk in enumerate(chunks):
-            chunk.metadata.update({
-                "user_id": user_id,
-                "file_path": file_path,
-                "file_type": file_type,
-                "upload_timestamp": datetime.now().isoformat(),
-                "chunk_index": i
-            })
-
-        self.vector_store.add_documents(chunks)
-        self.vector_store.save_local(self.vector_store_path)
-
-        doc_record = DocumentStore(
-            user_id=user_id,
-            filename=os.path.basename(file_path),
-            file_type=file_type,
-            file_path=file_path,
-            chunk_count=len(chunks),
-            processed_at=datetime.now()
-        )
-        db.add(doc_record)
-        db.commit()
+            logger.error(f"Failed processing document {file_path}: {e}")
+            deleted = isinstance(e, DocumentDeletedError)
+            await asyncio.to_thread(
+                self._fail_ingestion, db, user_id, record_id, file_path, chunk_count, None if deleted else str(e)
+            )
+            if deleted:
+                return {"status": "error", "message": "Document was deleted during ingestion"}
+            return {"status": "error", "message": f"Failed to process document: {str(e)}"}
+
+        # Cached answers were generated without this document
+        answer_cache.invalidate_user(user_id)
 
         return {
             "status": "success",
-            "chunks_processed": len(chunks),
-            "document_id": doc_record.id,
-            "message": f"Processed {len(chunks)} chunks from {os.path.basename(file_path)}"
+            "chunks_processed": chunk_count,
+            "pages_parsed": progress.pages_parsed,
+            "document_id": record_id,
+            "message": f"Processed {chunk_count} chunks from {os.path.basename(file_path)}"
         }
 
+    def _start_ingestion(
+        self, db: Session, file_path: str, file_type: str, user_id: int,
+        document_id: Optional[int], supported: bool,
+    ) -> Optional[int]:
+        """Mark the document's row as processing (failed if ``supported`` is False); returns its id."""
+        if document_id is not None:
+            doc_record = db.query(DocumentStore).filter(DocumentStore.id == document_id).first()
+            if not doc_record or doc_record.status == "deleting":
+                return None
+        else:
+            doc_record = DocumentStore(
+                user_id=user_id,
+                filename=os.path.basename(file_path),
+                file_type=file_type,
+                file_path=file_path,
+                chunk_count=0
+            )
+            db.add(doc_record)
+
+        if not supported:
+            doc_record.status = "failed"
+            doc_record.error = f"Unsupported file type: {file_type}"
+            db.commit()
+            return doc_record.id
+
+        if doc_record.status == "processing":
+            # Interrupted by a restart: hide whatever part of the file made it into the index
+            self.delete_document(user_id, doc_record.id, file_path=file_path)
+
+        # Committed first so chunk ids can carry the row's primary key
+        doc_record.status = "processing"
+        doc_record.error = None
+        db.commit()
+        return doc_record.id
+
+    def _finish_ingestion(self, db: Session, document_id: int, chunk_count: int) -> None:
+        from vector_index import DocumentDeletedError
+
+        # One conditional UPDATE, so a delete that starts after the last batch is not overwritten
+        updated = db.query(DocumentStore).filter(
+            DocumentStore.id == document_id, DocumentStore.status != "deleting"
+        ).update(
+            {"chunk_count": chunk_count, "status": "ready", "processed_at": datetime.now()},
+            synchronize_session=False,
+        )
+        db.commit()
+        if not updated:
+            raise DocumentDeletedError(f"Document {document_id} was deleted during ingestion")
+
+    def _fail_ingestion(
+        self, db: Session, user_id: int, document_id: int, file_path: str, chunk_count: int,
+        error: Optional[str],
+    ) -> None:
+        """Hide what was indexed and mark the row failed with ``error``; None if the row was deleted."""
+        db.rollback()
+        if chunk_count:
+            # Hide the batches that were already indexed before the failure
+            self.delete_document(user_id, document_id, file_path=file_path)
+        if error is None:
+            return
+        # Leaves rows that were deleted, or are being deleted, alone
+        db.query(DocumentStore).filter(
+            DocumentStore.id == document_id, DocumentStore.status != "deleting"
+        ).update({"status": "failed", "error": error}, synchronize_session=False)
+        db.commit()
+
+    @staticmethod
+    def _document_exists(db: Session, document_id: int) -> bool:
+        """False once the row is gone or DELETE /documents has started on it."""
+        row = db.query(DocumentStore.status).filter(DocumentStore.id == document_id).first()
+        return row is not None and row.status != "deleting"
+
+    def _index_batch(self, user_id: int, chunks: List["Document"], vectors, ids: List[str], first: bool) -> None:
+        # Only the first batch may take over a deleted document's id; later ones are refused once it is deleted
+        self.tenant_indexes.add_embeddings(user_id, chunks, vectors, ids, replace=first)
+        self.lexical_indexes.add(user_id, ids, chunks)
+
+    def delete_document(self, user_id: int, document_id: int, file_path: Optional[str] = None) -> int:
+        """Remove a document's chunks from the user's index; returns how many were hidden."""
+        removed = self.tenant_indexes.delete_document(user_id, document_id, file_path=file_path)
+        self.lexical_indexes.delete_document(user_id, document_id)
+        answer_cache.invalidate_user(user_id)
+        return removed
+
+    @staticmethod
+    def _candidate_k(k: int) -> int:
+        # Fusion and MMR both need a deeper list than the k that is finally returned
+        return max(4 * k, 20)
+
+    def _fuse(
+        self, user_id: int, vector_docs: List["Document"], lexical_ids: List[str], k: int
+    ) -> Tuple[List["Document"], Optional[List[float]]]:
+        """Reciprocal rank fusion of the vector hits with the user's BM25 hits, and the fused scores."""
+        if not self.hybrid_search or not vector_docs:
+            return vector_docs, None
+        fused = reciprocal_rank_fusion([[doc.id for doc in vector_docs], lexical_ids], k=self.rrf_k)
+        fused = fused[:self._candidate_k(k)]
 
-    def search_knowledge_base(self, query: str, k: int = 5, user_id: int = None) -> List[Document]:
-        fetch_k = k * 5 if user_id is not None else k
-        results = self.vector_store.similarity_search(query, k=fetch_k)
-        logger.info(f"Similarity search returned {len(results)} documents for query '{query}'")
+        by_id = {doc.id: doc for doc in vector_docs}
+        lexical_only = [chunk_id for chunk_id, _ in fused if chunk_id not in by_id]
+        by_id.update((doc.id, doc) for doc in self.tenant_indexes.get_documents(user_id, lexical_only))
+        fused = [(chunk_id, score) for chunk_id, score in fused if chunk_id in by_id]
+        return [by_id[chunk_id] for chunk_id, _ in fused], [score for _, score in fused]
 
+    def _retrieve(self, user_id: int, query: str, query_vector, k: int,
+                  search_params: Optional[SearchParams]) -> List["Document"]:
+        """Vector + lexical candidates, narrowed to k merged, de-duplicated and diverse chunks."""
+        from chunk_selection import select_chunks
+
+        lexical_ids = []
+        if self.hybrid_search:
+            # Outside the tenant lock: opening a BM25 index may backfill it from the vector index
+            lexical_hits = self.lexical_indexes.search(user_id, query, self._candidate_k(k))
+            lexical_ids = [chunk_id for chunk_id, _ in lexical_hits]
+        # One consistent view of the index, so a compaction cannot drop a hit before its vector is read
+        with self.tenant_indexes.lock(user_id):
+            vector_docs = self.tenant_indexes.search_by_vector(
+                user_id, query_vector, k=self._candidate_k(k), params=search_params
+            )
+            docs, scores = self._fuse(user_id, vector_docs, lexical_ids, k)
+            if not docs:
+                return []
+            # MMR runs on the vectors already stored in the index; nothing is re-embedded
+            vectors = self.tenant_indexes.get_vectors(user_id, [doc.id for doc in docs])
+        return select_chunks(docs, vectors, k, scores=scores, query_vector=query_vector, mmr_lambda=self.mmr_lambda)
+
+    def search_knowledge_base(
+        self, query: str, k: int = 5, user_id: int = None, search_params: Optional[SearchParams] = None
+    ) -> List["Document"]:
         if user_id is not None:
-            filtered = [doc for doc in results if doc.metadata.get("user_id") == user_id]
-            logger.info(f"{len(filtered)} documents remain after filtering by user_id={user_id}")
-            return filtered[:k]
-    
+            # Only scan this user's partition, so k hits come back regardless of other users' data
+            if self.tenant_indexes.get(user_id) is None:
+                return []
+            query_vector = self.embeddings.embed_query(query)
+            results = self._retrieve(user_id, query, query_vector, k, search_params)
+            logger.info(f"Search returned {len(results)} documents for user_id={user_id}")
+            return results
+
+        logger.warning("Knowledge base search without a user_id; every index is per-user")
+        return []
+
+    async def asearch_knowledge_base(
+        self, query: str, k: int = 5, user_id: int = None, search_params: Optional[SearchParams] = None
+    ) -> List["Document"]:
+        """Same as search_knowledge_base, but embeds the query off the event loop."""
+        if user_id is None:
+            logger.warning("Knowledge base search without a user_id; every index is per-user")
+            return []
+        query_vector = await self.embeddings.aembed_query(query)
+        # The first lexical lookup for a user may backfill their BM25 index
+        results = await asyncio.to_thread(self._retrieve, user_id, query, query_vector, k, search_params)
+        logger.info(f"Search returned {len(results)} documents for user_id={user_id}")
         return results
 
+    @staticmethod
+    def build_context(docs: List["Document"], max_context_tokens: Optional[int] = None) -> PackedContext:
+        """Pack ``docs`` into a token-budgeted context; see context_packing."""
+        packed = pack_context(docs, max_context_tokens)
+        logger.info(
+            f"Packed {packed.chunks_used}/{len(docs)} chunks into {packed.tokens} context tokens"
+            f"{' (truncated)' if packed.truncated else ''}"
+        )
+        return packed
+
+    def get_context_for_query(
+        self, query: str, user_id: int = None, max_context_tokens: Optional[int] = None,
+        search_params: Optional[SearchParams] = None,
+    ) -> str:
+        docs = self.search_knowledge_base(query, k=5, user_id=user_id, search_params=search_params)
+        return self.build_context(docs, max_context_tokens).text
+
+    async def aget_context_for_query(
+        self, query: str, user_id: int = None, max_context_tokens: Optional[int] = None,
+        search_params: Optional[SearchParams] = None,
+    ) -> str:
+        docs = await self.asearch_knowledge_base(query, k=5, user_id=user_id, search_params=search_params)
+        return self.build_context(docs, max_context_tokens).text
+
+
+_rag_system: Optional[MedicalRAGSystem] = None
+_rag_system_lock = threading.Lock()
+
+
+def get_rag_system() -> MedicalRAGSystem:
+    """Return the shared engine, building it on first use.
+
+    Building loads the embedding backend and recovers every tenant index, so
+    it is deferred until a request (or the startup warm-up) needs it.
+    """
+    global _rag_system
+    if _rag_system is None:
+        with _rag_system_lock:
+            if _rag_system is None:
+                _rag_system = MedicalRAGSystem()
+    return _rag_system
+
 
+async def aget_rag_system() -> MedicalRAGSystem:
+    """Like get_rag_system, but builds the engine off the event loop."""
+    if _rag_system is not None:
+        return _rag_system
+    return await asyncio.to_thread(get_rag_system)
 
-    def get_context_for_query(self, query: str, user_id: int = None, max_context_length: int = 3000) -> str:
-        docs = self.search_knowledge_base(query, k=5, user_id=user_id)
-        context_parts = []
-        total_length = 0
-        for doc in docs:
-            content = doc.page_content
-            if total_length + len(content) > max_context_length:
-                remaining = max_context_length - total_length
-                context_parts.append(content[:remaining])
-                break
-            context_parts.append(content)
-            total_length += len(content)
-        return "\n\n".join(context_parts)
 
-# Instantiate global rag_system
-rag_system = MedicalRAGSystem()
+def rag_system_loaded() -> bool:
+    return _rag_system is not None
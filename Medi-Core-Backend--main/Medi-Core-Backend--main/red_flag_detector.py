@@ -0,0 +1,180 @@
+"""Semantic second stage for red-flag detection in triage.
+
+Keyword matching misses paraphrases such as "my chest feels crushed and I
+can't catch my breath". The red-flag keywords from ``triage_keywords.json``,
+plus the descriptions below, are embedded once with the RAG engine's
+embedding backend into an L2-normalized matrix. Each triage message is then
+embedded and scored against every phrase with one matrix-vector product; a
+cosine similarity of ``SEMANTIC_RED_FLAG_THRESHOLD`` (default 0.6) or more
+counts as a red flag.
+
+Embedding the message is the only model call per turn. It is given
+``SEMANTIC_RED_FLAG_TIMEOUT`` seconds (default 0.5) and the check is skipped
+when it runs over, so a slow backend never holds up triage. Building the
+detector embeds every phrase, so turns never wait for it: warm-up builds it,
+and until then the check is skipped while a background thread builds it. A
+failed build is not retried for ``SEMANTIC_RED_FLAG_RETRY`` seconds (default
+300). Set ``SEMANTIC_RED_FLAGS=false`` to turn the stage off.
+"""
+import os
+import time
+import asyncio
+import logging
+import threading
+from typing import TYPE_CHECKING, List, NamedTuple, Optional, Sequence
+
+from keyword_matcher import keyword_matcher
+
+if TYPE_CHECKING:
+    from langchain_core.embeddings import Embeddings
+
+logger = logging.getLogger(__name__)
+
+SEMANTIC_RED_FLAGS_ENABLED = os.getenv("SEMANTIC_RED_FLAGS", "true").lower() == "true"
+DEFAULT_THRESHOLD = float(os.getenv("SEMANTIC_RED_FLAG_THRESHOLD", "0.6"))
+DEFAULT_TIMEOUT = float(os.getenv("SEMANTIC_RED_FLAG_TIMEOUT", "0.5"))
+RETRY_SECONDS = float(os.getenv("SEMANTIC_RED_FLAG_RETRY", "300"))
+
+# Whole-sentence descriptions embed closer to how patients phrase emergencies than bare keywords
+RED_FLAG_DESCRIPTIONS = (
+    "my chest feels crushed and I can't catch my breath",
+    "tight pressure in my chest spreading to my arm or jaw",
+    "I suddenly can't get enough air",
+    "my lips or face are turning blue",
+    "the worst headache I have ever had came on suddenly",
+    "one side of my face is drooping",
+    "my arm and leg on one side went numb and weak",
+    "I can't get my words out or understand people",
+    "I blacked out and don't remember what happened",
+    "I'm throwing up blood or something that looks like coffee grounds",
+    "my stool is black and tarry",
+    "my throat is swelling shut after eating or a sting",
+    "I have a fever and can't bend my neck forward",
+    "I lost the vision in one eye all of a sudden",
+    "I want to kill myself or end my life",
+)
+
+
+class RedFlagMatch(NamedTuple):
+    phrase: str
+    score: float
+
+
+class SemanticRedFlagDetector:
+    """Scores messages against a precomputed matrix of red-flag phrase embeddings."""
+
+    def __init__(self, embeddings: "Embeddings", phrases: Sequence[str],
+                 threshold: float = DEFAULT_THRESHOLD, timeout: float = DEFAULT_TIMEOUT,
+                 min_words: int = 3):
+        import numpy as np
+
+        self.embeddings = embeddings
+        self.phrases: List[str] = list(dict.fromkeys(phrases))
+        self.threshold = threshold
+        self.timeout = timeout
+        # Single-word turns ("yes", "35", "male") carry no symptoms to score
+        self.min_words = min_words
+
+        start = time.perf_counter()
+        matrix = np.asarray(embeddings.embed_documents(self.phrases), dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        self.matrix = np.ascontiguousarray(matrix / norms)
+        logger.info(
+            f"Embedded {len(self.phrases)} red-flag phrases in {(time.perf_counter() - start) * 1000:.0f} ms"
+        )
+
+    def best_match(self, vector) -> RedFlagMatch:
+        """Closest red-flag phrase to an embedded message."""
+        import numpy as np
+
+        vector = np.asarray(vector, dtype=np.float32)
+        scores = self.matrix @ (vector / (np.linalg.norm(vector) or 1.0))
+        best = int(np.argmax(scores))
+        return RedFlagMatch(self.phrases[best], float(scores[best]))
+
+    def _check(self, vector) -> Optional[RedFlagMatch]:
+        match = self.best_match(vector)
+        if match.score < self.threshold:
+            return None
+        logger.info(f"Semantic red flag {match.phrase!r} (score {match.score:.2f}) in triage message")
+        return match
+
+    def detect(self, message: str) -> Optional[RedFlagMatch]:
+        if len(message.split()) < self.min_words:
+            return None
+        return self._check(self.embeddings.embed_query(message))
+
+    async def adetect(self, message: str) -> Optional[RedFlagMatch]:
+        """Like detect, but gives up (returns None) if embedding takes longer than ``timeout``."""
+        if len(message.split()) < self.min_words:
+            return None
+        try:
+            vector = await asyncio.wait_for(self.embeddings.aembed_query(message), self.timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Semantic red-flag check skipped: embedding took over {self.timeout}s")
+            return None
+        return self._check(vector)
+
+
+_detector: Optional[SemanticRedFlagDetector] = None
+_detector_lock = threading.Lock()
+# time.monotonic() of the last failed build
+_failed_at: Optional[float] = None
+
+
+def _retry_pending() -> bool:
+    return _failed_at is not None and time.monotonic() - _failed_at < RETRY_SECONDS
+
+
+def get_red_flag_detector() -> Optional[SemanticRedFlagDetector]:
+    """The shared detector, built on first use from the RAG engine's embeddings.
+
+    Returns None when the stage is disabled or the last build failed less than
+    ``RETRY_SECONDS`` ago; a failing build raises.
+    """
+    global _detector, _failed_at
+    if not SEMANTIC_RED_FLAGS_ENABLED:
+        return None
+    if _detector is None:
+        with _detector_lock:
+            if _detector is None:
+                if _retry_pending():
+                    return None
+                from rag_system import get_rag_system
+
+                phrases = [*keyword_matcher.keyword_sets.get("red_flags", []), *RED_FLAG_DESCRIPTIONS]
+                try:
+                    _detector = SemanticRedFlagDetector(get_rag_system().embeddings, phrases)
+                except Exception:
+                    _failed_at = time.monotonic()
+                    raise
+                _failed_at = None
+    return _detector
+
+
+def _build_detector() -> None:
+    try:
+        get_red_flag_detector()
+    except Exception as e:
+        logger.error(f"Building the semantic red-flag detector failed, retrying in {RETRY_SECONDS:.0f}s: {e}")
+
+
+async def detect_red_flag(message: str) -> Optional[RedFlagMatch]:
+    """Run the semantic check on a triage message; failures only disable it for this turn.
+
+    Until the detector is built this returns None and starts the build in the
+    background, unless one is already running or the last one failed recently.
+    """
+    if not SEMANTIC_RED_FLAGS_ENABLED:
+        return None
+    detector = _detector
+    if detector is None:
+        if not _detector_lock.locked() and not _retry_pending():
+            threading.Thread(target=_build_detector, name="red-flag-detector", daemon=True).start()
+        return None
+    try:
+        return await detector.adetect(message)
+    except Exception as e:
+        logger.error(f"Semantic red-flag check failed: {e}")
+        return None
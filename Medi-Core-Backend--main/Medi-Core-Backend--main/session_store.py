@@ -0,0 +1,244 @@
+"""Where in-progress triage conversations live between turns.
+
+``TRIAGE_SESSION_STORE`` picks the backend:
+
+* ``memory`` (default) - an LRU of at most ``TRIAGE_SESSION_MAX`` (1000)
+  sessions in this process
+* ``sqlite`` - a SQLite file at ``TRIAGE_SESSION_DB_PATH`` shared by every
+  worker on the host, so a user's next turn can land on any of them
+
+Both drop sessions that have been idle for ``TRIAGE_SESSION_TTL_SECONDS``
+(default 15 minutes). The store is only a cache: every turn is also
+written to the session's ``ChatSession`` row, and a session that has been
+evicted is rebuilt from that row with ``TriageSession.from_chat_session``.
+Handlers load a session with ``get`` and must ``save`` it after changing
+it; only the memory backend hands out live objects. Async code uses
+``aget`` / ``asave`` / ``adelete``, which run the SQLite backend in a worker
+thread.
+"""
+import os
+import json
+import asyncio
+import time
+import logging
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from datetime import datetime
+from enum import Enum
+from typing import Any, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+# Medical triage stages
+class TriageStage(Enum):
+    GREETING = "greeting"
+    CONSENT = "consent"
+    DEMOGRAPHICS = "demographics"
+    MEDICAL_HISTORY = "medical_history"
+    MAIN_SYMPTOMS = "main_symptoms"
+    SYMPTOM_DETAILS = "symptom_details"
+    ASSOCIATED_SYMPTOMS = "associated_symptoms"
+    SUMMARY_CONFIRMATION = "summary_confirmation"
+    FINAL_ASSESSMENT = "final_assessment"
+    COMPLETED = "completed"
+
+
+class TriageSession:
+    __slots__ = ("stage", "data", "completed", "created_at", "red_flags_detected")
+
+    def __init__(self):
+        self.stage = TriageStage.GREETING
+        self.data: Dict[str, Any] = {}
+        self.completed = False
+        self.created_at = datetime.now()
+        self.red_flags_detected = False
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "stage": self.stage.value,
+            "data": self.data,
+            "completed": self.completed,
+            "created_at": self.created_at.isoformat(),
+            "red_flags_detected": self.red_flags_detected,
+        }
+
+    @classmethod
+    def from_dict(cls, state: Dict[str, Any]) -> "TriageSession":
+        session = cls()
+        session.stage = TriageStage(state["stage"])
+        session.data = state["data"]
+        session.completed = state["completed"]
+        session.created_at = datetime.fromisoformat(state["created_at"])
+        session.red_flags_detected = state["red_flags_detected"]
+        return session
+
+    @classmethod
+    def from_chat_session(cls, row) -> "TriageSession":
+        """Rebuild the conversation state from its ``ChatSession`` database row."""
+        session = cls()
+        session.stage = TriageStage(row.stage)
+        session.completed = bool(row.completed)
+        session.red_flags_detected = bool(row.emergency_detected)
+        if row.created_at is not None:
+            session.created_at = row.created_at
+        session.data["user_id"] = row.user_id
+        # Consent is not stored; any stage past CONSENT means it was given
+        stages = list(TriageStage)
+        if stages.index(session.stage) > stages.index(TriageStage.CONSENT) and not session.completed:
+            session.data["consent"] = True
+        for field in ("age", "sex", "medical_history", "main_symptoms", "symptom_details", "associated_symptoms"):
+            value = getattr(row, field)
+            if value is not None:
+                session.data[field] = value
+        return session
+
+
+class SessionStore(ABC):
+    """Triage sessions keyed by session id."""
+
+    @abstractmethod
+    def get(self, session_id: str) -> Optional[TriageSession]:
+        """The session, or None if it never existed or has expired."""
+
+    @abstractmethod
+    def save(self, session_id: str, session: TriageSession) -> None:
+        """Store ``session`` and restart its idle timer."""
+
+    @abstractmethod
+    def delete(self, session_id: str) -> None:
+        ...
+
+    def close(self) -> None:
+        pass
+
+    async def aget(self, session_id: str) -> Optional[TriageSession]:
+        return await asyncio.to_thread(self.get, session_id)
+
+    async def asave(self, session_id: str, session: TriageSession) -> None:
+        await asyncio.to_thread(self.save, session_id, session)
+
+    async def adelete(self, session_id: str) -> None:
+        await asyncio.to_thread(self.delete, session_id)
+
+
+class MemorySessionStore(SessionStore):
+    """LRU of live session objects in this process, with an idle TTL."""
+
+    def __init__(self, max_sessions: int = 1000, ttl_seconds: float = 900.0):
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self._sessions: "OrderedDict[str, Tuple[TriageSession, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def get(self, session_id: str) -> Optional[TriageSession]:
+        with self._lock:
+            item = self._sessions.get(session_id)
+            if item is None:
+                return None
+            session, expires_at = item
+            if expires_at <= time.monotonic():
+                del self._sessions[session_id]
+                return None
+            # Reading counts as activity, which also keeps the LRU order equal to expiry order
+            self._sessions[session_id] = (session, time.monotonic() + self.ttl_seconds)
+            self._sessions.move_to_end(session_id)
+            return session
+
+    def save(self, session_id: str, session: TriageSession) -> None:
+        now = time.monotonic()
+        with self._lock:
+            self._sessions[session_id] = (session, now + self.ttl_seconds)
+            self._sessions.move_to_end(session_id)
+            # Expired sessions sit at the front too, so this also sweeps them
+            while self._sessions:
+                oldest_id, (_, expires_at) = next(iter(self._sessions.items()))
+                if len(self._sessions) <= self.max_sessions and expires_at > now:
+                    break
+                del self._sessions[oldest_id]
+
+    def delete(self, session_id: str) -> None:
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    # Nothing here blocks, so the async variants skip the thread hop
+    async def aget(self, session_id: str) -> Optional[TriageSession]:
+        return self.get(session_id)
+
+    async def asave(self, session_id: str, session: TriageSession) -> None:
+        self.save(session_id, session)
+
+    async def adelete(self, session_id: str) -> None:
+        self.delete(session_id)
+
+
+class SQLiteSessionStore(SessionStore):
+    """Sessions serialized to JSON in a SQLite file that several workers can share."""
+
+    def __init__(self, db_path: str = "triage_sessions.db", ttl_seconds: float = 900.0,
+                 purge_every: int = 500):
+        self.db_path = db_path
+        self.ttl_seconds = ttl_seconds
+        self.purge_every = purge_every
+        self._saves = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, timeout=10.0)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS triage_sessions ("
+            " session_id TEXT PRIMARY KEY, state TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS triage_sessions_expiry ON triage_sessions (expires_at)")
+        self._conn.commit()
+
+    def get(self, session_id: str) -> Optional[TriageSession]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT state FROM triage_sessions WHERE session_id = ? AND expires_at > ?",
+                (session_id, time.time()),
+            ).fetchone()
+        return TriageSession.from_dict(json.loads(row[0])) if row else None
+
+    def save(self, session_id: str, session: TriageSession) -> None:
+        # Wall-clock expiry, since the workers sharing the file do not share a monotonic clock
+        now = time.time()
+        state = json.dumps(session.to_dict())
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO triage_sessions VALUES (?, ?, ?)",
+                (session_id, state, now + self.ttl_seconds),
+            )
+            self._saves += 1
+            if self._saves % self.purge_every == 0:
+                purged = self._conn.execute("DELETE FROM triage_sessions WHERE expires_at <= ?", (now,)).rowcount
+                if purged:
+                    logger.info(f"Purged {purged} expired triage sessions")
+            self._conn.commit()
+
+    def delete(self, session_id: str) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM triage_sessions WHERE session_id = ?", (session_id,))
+            self._conn.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def create_session_store(backend: Optional[str] = None) -> SessionStore:
+    """Build the store named by ``backend`` or ``TRIAGE_SESSION_STORE``."""
+    backend = (backend or os.getenv("TRIAGE_SESSION_STORE", "memory")).lower()
+    ttl_seconds = float(os.getenv("TRIAGE_SESSION_TTL_SECONDS", "900"))
+    if backend == "memory":
+        return MemorySessionStore(int(os.getenv("TRIAGE_SESSION_MAX", "1000")), ttl_seconds)
+    if backend == "sqlite":
+        return SQLiteSessionStore(os.getenv("TRIAGE_SESSION_DB_PATH", "triage_sessions.db"), ttl_seconds)
+    raise ValueError(f"Unknown TRIAGE_SESSION_STORE {backend!r}; expected 'memory' or 'sqlite'")
+
+
+session_store = create_session_store()
@@ -0,0 +1,32 @@
+import pytest
+
+from keyword_matcher import keyword_matcher
+
+
+@pytest.mark.parametrize("message", [
+    "She had a seizure and then passed out for a minute",
+    "I keep having seizures since this morning",
+    "He had convulsions last night",
+    "I woke up with sudden blindness in my left eye",
+    "I have chest   pain and can't breathe",
+    "He has been having fits all afternoon",
+])
+def test_red_flags_are_detected(message):
+    assert keyword_matcher.has(message, "red_flags")
+
+
+@pytest.mark.parametrize("message", [
+    "I can't seem to shake this cough",
+    "I go to a fitness class twice a week",
+    "The new brace fitted well",
+    "Would it benefit me to rest more?",
+    "We passed outside the clinic on the way home",
+    "I unconsciously scratch my arm at night",
+])
+def test_red_flags_need_whole_words(message):
+    assert not keyword_matcher.has(message, "red_flags")
+
+
+def test_painting_is_not_pain():
+    assert not keyword_matcher.has("I spent the weekend painting the kitchen", "symptoms")
+    assert keyword_matcher.has("The pain is in my lower back", "symptoms")
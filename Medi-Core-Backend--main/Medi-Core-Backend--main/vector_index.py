@@ -0,0 +1,627 @@
+"""Per-user partitioned FAISS indexes for the medical knowledge base.
+
+Every user's chunks live in their own FAISS index under ``<root>/user_<id>``,
+so a query only scans that user's vectors instead of searching one shared
+index and throwing away other users' hits afterwards.
+
+On disk a partition is an immutable base snapshot plus append-only delta
+segments::
+
+    user_<id>/MANIFEST.json              {"base": "base_00000004", "last_segment": 12, "generation": 4}
+    user_<id>/base_00000004/index.*      snapshot covering segments 1..12
+    user_<id>/segments/seg_00000013/     one segment per upload
+    user_<id>/TOMBSTONES.json            documents deleted since the last compaction
+
+An upload only writes its own segment, so its cost depends on the size of the
+new file rather than the whole corpus. Segments are folded into a new base
+snapshot in the background once uploads go quiet. Every file is written to a
+``.tmp`` path and renamed into place, so a crash leaves either the old state
+or the new one, never a half-written index.
+
+Chunk ids are ``"<DocumentStore.id>:<chunk_index>"``. Deleting a document
+records a tombstone that hides its chunks from searches immediately; once
+dead chunks pass ``compact_ratio`` of the partition, a background compaction
+removes them from the FAISS index and writes a fresh snapshot.
+Segments for a tombstoned document are refused, so an ingestion still running
+when its document is deleted cannot bring it back; only the first batch of a
+new ingestion may reuse the id, which purges just that document's old chunks.
+
+Partitions start as exact flat indexes; when a merge finds one past the
+``IndexPolicy`` threshold it is rebuilt as HNSW or IVF(-PQ) (see ``ann_index``).
+"""
+import os
+import json
+import shutil
+import logging
+import threading
+from collections import OrderedDict
+from typing import Collection, Dict, List, Optional, Tuple
+
+import faiss
+import numpy as np
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from ann_index import IndexPolicy, SearchParams, build_index, can_build, index_type_of, reconstruct, search_parameters
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILE = "MANIFEST.json"
+TOMBSTONES_FILE = "TOMBSTONES.json"
+SEGMENTS_DIR = "segments"
+
+
+def _fsync_dir(path: str) -> None:
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return  # directories cannot be opened on Windows
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def _fsync_tree(path: str) -> None:
+    for name in os.listdir(path):
+        with open(os.path.join(path, name), "rb") as f:
+            os.fsync(f.fileno())
+    _fsync_dir(path)
+
+
+def _write_json_atomically(path: str, data) -> None:
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    _fsync_dir(os.path.dirname(path))
+
+
+def _save_atomically(store: FAISS, final_path: str) -> None:
+    tmp_path = final_path + ".tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    store.save_local(tmp_path)
+    _fsync_tree(tmp_path)
+    os.replace(tmp_path, final_path)
+    _fsync_dir(os.path.dirname(final_path))
+
+
+class DocumentDeletedError(Exception):
+    """A segment was committed for a document that has been deleted."""
+
+
+class TenantIndexManager:
+    """Creates, loads and caches one FAISS index per user on demand."""
+
+    def __init__(
+        self,
+        root_path: str,
+        embeddings: Embeddings,
+        max_resident: int = 64,
+        merge_delay: float = 30.0,
+        max_segments: int = 16,
+        compact_ratio: float = 0.2,
+        policy: Optional[IndexPolicy] = None,
+    ):
+        self.root_path = root_path
+        self.embeddings = embeddings
+        self.max_resident = max_resident
+        self.merge_delay = merge_delay
+        self.max_segments = max_segments
+        self.compact_ratio = compact_ratio
+        self.policy = policy or IndexPolicy.from_env()
+        self._stores: "OrderedDict[int, FAISS]" = OrderedDict()
+        self._tenant_locks: Dict[int, threading.RLock] = {}
+        self._last_segment: Dict[int, int] = {}
+        self._base_segment: Dict[int, int] = {}
+        self._merge_timers: Dict[int, threading.Timer] = {}
+        # document_id -> file_path of deleted documents whose chunks are still in the index
+        self._tombstones: Dict[int, Dict[int, str]] = {}
+        self._dead_chunks: Dict[int, int] = {}
+        # chunk id -> position maps for get_vectors, keyed by the index they were built from
+        self._positions: Dict[int, Tuple[faiss.Index, int, Dict[str, int]]] = {}
+        self._lock = threading.RLock()
+
+    def _tenant_path(self, user_id: int) -> str:
+        return os.path.join(self.root_path, f"user_{user_id}")
+
+    def _tenant_lock(self, user_id: int) -> threading.RLock:
+        with self._lock:
+            return self._tenant_locks.setdefault(user_id, threading.RLock())
+
+    def _remember(self, user_id: int, store: FAISS) -> None:
+        with self._lock:
+            self._stores[user_id] = store
+            self._stores.move_to_end(user_id)
+            while len(self._stores) > self.max_resident:
+                evicted_id, _ = self._stores.popitem(last=False)
+                logger.info(f"Evicted vector index for user_id={evicted_id} from memory")
+
+    # ---- on-disk layout -------------------------------------------------
+
+    @staticmethod
+    def _read_manifest(path: str) -> dict:
+        manifest_path = os.path.join(path, MANIFEST_FILE)
+        if not os.path.exists(manifest_path):
+            return {}
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    @staticmethod
+    def _read_tombstones(path: str) -> Dict[int, str]:
+        tombstones_path = os.path.join(path, TOMBSTONES_FILE)
+        if not os.path.exists(tombstones_path):
+            return {}
+        with open(tombstones_path, "r", encoding="utf-8") as f:
+            return {int(document_id): file_path for document_id, file_path in json.load(f).items()}
+
+    @staticmethod
+    def _segments(path: str) -> List[Tuple[int, str]]:
+        segments_path = os.path.join(path, SEGMENTS_DIR)
+        if not os.path.isdir(segments_path):
+            return []
+        segments = []
+        for name in os.listdir(segments_path):
+            if name.startswith("seg_") and not name.endswith(".tmp"):
+                segments.append((int(name[len("seg_"):]), os.path.join(segments_path, name)))
+        return sorted(segments)
+
+    @staticmethod
+    def _base_path(path: str, manifest: dict) -> str:
+        # Partitions written before segments existed keep their index in the tenant root
+        return os.path.join(path, manifest["base"]) if manifest else path
+
+    def _prune(self, path: str) -> None:
+        """Delete half-written files and anything already covered by the current base."""
+        manifest = self._read_manifest(path)
+        last_segment = manifest.get("last_segment", 0)
+
+        for root in (path, os.path.join(path, SEGMENTS_DIR)):
+            if not os.path.isdir(root):
+                continue
+            for name in os.listdir(root):
+                if name.endswith(".tmp"):
+                    target = os.path.join(root, name)
+                    if os.path.isdir(target):
+                        shutil.rmtree(target, ignore_errors=True)
+                    else:
+                        os.remove(target)
+
+        if not manifest:
+            return
+        for name in os.listdir(path):
+            target = os.path.join(path, name)
+            if name.startswith("base_") and name != manifest["base"]:
+                shutil.rmtree(target, ignore_errors=True)
+            elif name in ("index.faiss", "index.pkl"):
+                os.remove(target)
+        for seq, segment_path in self._segments(path):
+            if seq <= last_segment:
+                shutil.rmtree(segment_path, ignore_errors=True)
+
+    def recover(self) -> None:
+        """Clean up after an interrupted write or merge; run once on startup."""
+        if not os.path.isdir(self.root_path):
+            return
+        for name in os.listdir(self.root_path):
+            path = os.path.join(self.root_path, name)
+            if name.startswith("user_") and os.path.isdir(path):
+                try:
+                    self._prune(path)
+                except Exception as e:
+                    logger.warning(f"Failed to recover vector index at {path}: {e}")
+
+    def _load_from_disk(self, user_id: int) -> Optional[FAISS]:
+        path = self._tenant_path(user_id)
+        if not os.path.isdir(path):
+            return None
+
+        manifest = self._read_manifest(path)
+        base_segment = manifest.get("last_segment", 0)
+        last_segment = base_segment
+        store = None
+
+        base_path = self._base_path(path, manifest)
+        if os.path.exists(os.path.join(base_path, "index.faiss")):
+            store = FAISS.load_local(base_path, self.embeddings, allow_dangerous_deserialization=True)
+
+        # Replay segments written after the last snapshot
+        for seq, segment_path in self._segments(path):
+            if seq <= base_segment:
+                continue
+            delta = FAISS.load_local(segment_path, self.embeddings, allow_dangerous_deserialization=True)
+            if store is None:
+                store = delta
+            else:
+                self._append(store, delta)
+            last_segment = seq
+
+        self._base_segment[user_id] = base_segment
+        self._last_segment[user_id] = last_segment
+        self._tombstones[user_id] = self._read_tombstones(path)
+        self._dead_chunks[user_id] = len(self._dead_chunk_ids(store, self._tombstones[user_id])) if store else 0
+        if last_segment > base_segment:
+            self._schedule_merge(user_id)
+        return store
+
+    # ---- tombstones -----------------------------------------------------
+
+    @staticmethod
+    def _is_dead(doc: Document, tombstones: Dict[int, str]) -> bool:
+        document_id = doc.metadata.get("document_id")
+        if document_id is not None:
+            return document_id in tombstones
+        # Chunks indexed before chunk ids were tied to documents are matched by file path
+        file_path = doc.metadata.get("file_path")
+        return file_path is not None and file_path in tombstones.values()
+
+    def _dead_chunk_ids(self, store: FAISS, tombstones: Dict[int, str]) -> List[str]:
+        if not tombstones:
+            return []
+        dead = []
+        for doc_id in store.index_to_docstore_id.values():
+            doc = store.docstore.search(doc_id)
+            if isinstance(doc, Document) and self._is_dead(doc, tombstones):
+                dead.append(doc_id)
+        return dead
+
+    # ---- index maintenance ----------------------------------------------
+
+    @staticmethod
+    def _append(store: FAISS, delta: FAISS) -> None:
+        """Add a segment's vectors to a live index of any type."""
+        if index_type_of(store.index) == "flat":
+            store.merge_from(delta)
+            return
+        # HNSW and IVF indexes cannot merge_from a flat segment, so re-add its vectors
+        rows = sorted(delta.index_to_docstore_id.items())
+        vectors = reconstruct(delta.index, [position for position, _ in rows])
+        docs = [delta.docstore.search(doc_id) for _, doc_id in rows]
+        store.add_embeddings(
+            zip([doc.page_content for doc in docs], vectors.tolist()),
+            metadatas=[doc.metadata for doc in docs],
+            ids=[doc_id for _, doc_id in rows],
+        )
+
+    def _rebuild(self, store: FAISS, index_type: str, exclude: Collection[str] = ()) -> None:
+        """Rebuild ``store.index`` as ``index_type``, leaving out the chunk ids in ``exclude``.
+
+        The caller holds the tenant lock; the new index and id map are swapped in together.
+        """
+        exclude = set(exclude)
+        rows = [
+            (position, doc_id)
+            for position, doc_id in sorted(store.index_to_docstore_id.items())
+            if doc_id not in exclude
+        ]
+        vectors = reconstruct(store.index, [position for position, _ in rows])
+        if not can_build(index_type, len(rows)):
+            index_type = "flat"
+        index = build_index(index_type, vectors, self.policy) if rows else faiss.IndexFlatL2(store.index.d)
+        index_to_docstore_id = {i: doc_id for i, (_, doc_id) in enumerate(rows)}
+        store.index, store.index_to_docstore_id = index, index_to_docstore_id
+        if exclude:
+            store.docstore.delete(list(exclude))
+
+    def _maybe_promote(self, user_id: int, store: FAISS) -> None:
+        current = index_type_of(store.index)
+        target = self.policy.target_type(store.index.ntotal)
+        # Only ever promote; a partition that shrinks keeps its approximate index
+        if current == "flat" and target != "flat":
+            self._rebuild(store, target)
+            logger.info(f"Promoted vector index of user_id={user_id} to {target} at {store.index.ntotal} vectors")
+
+    @staticmethod
+    def _search_vector(store: FAISS, embedding, k: int, params: Optional[SearchParams]) -> List[Document]:
+        if k <= 0 or store.index.ntotal == 0:
+            return []
+        query = np.asarray(embedding, dtype=np.float32).reshape(1, -1)
+        _, positions = store.index.search(query, k, params=search_parameters(store.index, params))
+        docs = []
+        for position in positions[0]:
+            if position == -1:
+                continue
+            doc_id = store.index_to_docstore_id[int(position)]
+            doc = store.docstore.search(doc_id)
+            if isinstance(doc, Document):
+                if doc.id is None:
+                    # Stores pickled by older LangChain versions do not carry the id
+                    doc.id = doc_id
+                docs.append(doc)
+        return docs
+
+    def _filter_dead(self, user_id: int, store: FAISS, search, k: int) -> List[Document]:
+        tombstones = self._tombstones.get(user_id)
+        if not tombstones:
+            return search(k)
+        # At most _dead_chunks hits can be filtered out, so this still yields k live chunks
+        fetch_k = min(k + self._dead_chunks.get(user_id, 0), store.index.ntotal)
+        docs = search(fetch_k)
+        return [doc for doc in docs if not self._is_dead(doc, tombstones)][:k]
+
+    # ---- public API -----------------------------------------------------
+
+    def lock(self, user_id: int) -> threading.RLock:
+        """The user's tenant lock; hold it to read several results from one consistent index."""
+        return self._tenant_lock(user_id)
+
+    def get(self, user_id: int) -> Optional[FAISS]:
+        """Return the user's index, loading it from disk if needed."""
+        with self._lock:
+            store = self._stores.get(user_id)
+            if store is not None:
+                self._stores.move_to_end(user_id)
+                return store
+
+        with self._tenant_lock(user_id):
+            with self._lock:
+                store = self._stores.get(user_id)
+            if store is not None:
+                return store
+            try:
+                store = self._load_from_disk(user_id)
+            except Exception as e:
+                logger.warning(f"Failed to load vector index for user_id={user_id}: {e}")
+                return None
+            if store is not None:
+                self._remember(user_id, store)
+            return store
+
+    def _commit_delta(self, user_id: int, delta: FAISS, replace: bool = False) -> None:
+        """Persist a new segment, then fold it into the in-memory index.
+
+        A segment for a tombstoned document is refused with DocumentDeletedError
+        unless ``replace`` says it starts a fresh ingestion of that id.
+        """
+        with self._tenant_lock(user_id):
+            store = self.get(user_id)
+            tombstones = self._tombstones.get(user_id)
+            if store is not None and tombstones:
+                deleted = {
+                    doc.metadata.get("document_id") for doc in delta.docstore._dict.values()
+                } & tombstones.keys()
+                if deleted and not replace:
+                    # A batch of an ingestion that was deleted while it ran
+                    raise DocumentDeletedError(f"Documents {sorted(deleted)} of user_id={user_id} were deleted")
+                if deleted:
+                    # A reused document id must not inherit the tombstone, or collide with
+                    # the dead chunk ids, so purge that document's old chunks first
+                    self._compact(user_id, deleted)
+            path = self._tenant_path(user_id)
+            os.makedirs(os.path.join(path, SEGMENTS_DIR), exist_ok=True)
+
+            seq = self._last_segment.get(user_id, 0) + 1
+            _save_atomically(delta, os.path.join(path, SEGMENTS_DIR, f"seg_{seq:08d}"))
+            self._last_segment[user_id] = seq
+
+            if store is None:
+                self._remember(user_id, delta)
+            else:
+                self._append(store, delta)
+        self._schedule_merge(user_id)
+
+    def add_documents(self, user_id: int, documents: List[Document], ids: Optional[List[str]] = None) -> int:
+        """Embed documents and append them to the user's index as a new segment."""
+        if not documents:
+            return 0
+        delta = FAISS.from_documents(documents, self.embeddings, ids=ids)
+        self._commit_delta(user_id, delta)
+        return len(documents)
+
+    def add_embeddings(
+        self, user_id: int, documents: List[Document], embeddings, ids: Optional[List[str]] = None,
+        replace: bool = False,
+    ) -> int:
+        """Append documents whose vectors were already computed as a new segment.
+
+        ``replace`` marks the first batch of a (re-)ingestion, which may reuse a
+        deleted document's id; see _commit_delta.
+        """
+        if not documents:
+            return 0
+        delta = FAISS.from_embeddings(
+            zip([doc.page_content for doc in documents], np.asarray(embeddings, dtype=np.float32)),
+            self.embeddings,
+            metadatas=[doc.metadata for doc in documents],
+            ids=ids,
+        )
+        self._commit_delta(user_id, delta, replace=replace)
+        return len(documents)
+
+    def delete_document(self, user_id: int, document_id: int, file_path: Optional[str] = None) -> int:
+        """Tombstone a document's chunks; they stop matching searches straight away."""
+        with self._tenant_lock(user_id):
+            store = self.get(user_id)
+            if store is None:
+                return 0
+            tombstones = self._tombstones.setdefault(user_id, {})
+            if document_id in tombstones:
+                return 0
+            tombstones[document_id] = file_path
+            dead_chunks = len(self._dead_chunk_ids(store, tombstones))
+            removed = dead_chunks - self._dead_chunks.get(user_id, 0)
+            self._dead_chunks[user_id] = dead_chunks
+            _write_json_atomically(os.path.join(self._tenant_path(user_id), TOMBSTONES_FILE), tombstones)
+            dead_ratio = dead_chunks / max(store.index.ntotal, 1)
+
+        logger.info(f"Tombstoned {removed} chunks of document {document_id} for user_id={user_id}")
+        if dead_ratio >= self.compact_ratio:
+            threading.Thread(target=self._compact, args=(user_id,), daemon=True).start()
+        return removed
+
+    def search(self, user_id: int, query: str, k: int = 5, params: Optional[SearchParams] = None) -> List[Document]:
+        if self.get(user_id) is None:
+            return []
+        return self.search_by_vector(user_id, self.embeddings.embed_query(query), k=k, params=params)
+
+    def search_by_vector(
+        self, user_id: int, embedding, k: int = 5, params: Optional[SearchParams] = None
+    ) -> List[Document]:
+        # Appends, merges and compactions swap the index and id map under this lock
+        with self._tenant_lock(user_id):
+            store = self.get(user_id)
+            if store is None:
+                return []
+            return self._filter_dead(
+                user_id, store, lambda fetch_k: self._search_vector(store, embedding, fetch_k, params), k
+            )
+
+    def get_documents(self, user_id: int, chunk_ids: List[str]) -> List[Document]:
+        """Live chunks by id, in the given order; unknown and deleted ids are skipped."""
+        with self._tenant_lock(user_id):
+            store = self.get(user_id)
+            if store is None:
+                return []
+            tombstones = self._tombstones.get(user_id, {})
+            docs = []
+            for chunk_id in chunk_ids:
+                doc = store.docstore.search(chunk_id)
+                if isinstance(doc, Document) and not self._is_dead(doc, tombstones):
+                    if doc.id is None:
+                        doc.id = chunk_id
+                    docs.append(doc)
+            return docs
+
+    def get_vectors(self, user_id: int, chunk_ids: List[str]) -> np.ndarray:
+        """Stored vectors of ``chunk_ids`` (one row each), read back from the index."""
+        with self._tenant_lock(user_id):
+            store = self.get(user_id)
+            if store is None:
+                return np.empty((0, 0), dtype=np.float32)
+            cached = self._positions.get(user_id)
+            # Appends grow ntotal and rebuilds swap the index, both invalidate the map
+            if cached is None or cached[0] is not store.index or cached[1] != store.index.ntotal:
+                positions = {doc_id: position for position, doc_id in store.index_to_docstore_id.items()}
+                cached = self._positions[user_id] = (store.index, store.index.ntotal, positions)
+            return reconstruct(store.index, [cached[2][chunk_id] for chunk_id in chunk_ids])
+
+    def iter_documents(self, user_id: int) -> List[Tuple[str, Document]]:
+        """Every live ``(chunk_id, chunk)`` in the user's index."""
+        with self._tenant_lock(user_id):
+            store = self.get(user_id)
+            if store is None:
+                return []
+            tombstones = self._tombstones.get(user_id, {})
+            rows = []
+            for chunk_id in store.index_to_docstore_id.values():
+                doc = store.docstore.search(chunk_id)
+                if isinstance(doc, Document) and not self._is_dead(doc, tombstones):
+                    rows.append((chunk_id, doc))
+            return rows
+
+    # ---- background merging ---------------------------------------------
+
+    def _schedule_merge(self, user_id: int) -> None:
+        """Debounce snapshotting: merge once uploads stop, or right away if segments pile up."""
+        pending = self._last_segment.get(user_id, 0) - self._base_segment.get(user_id, 0)
+        delay = 0 if pending >= self.max_segments else self.merge_delay
+        with self._lock:
+            timer = self._merge_timers.pop(user_id, None)
+            if timer is not None:
+                timer.cancel()
+            timer = threading.Timer(delay, self._merge, args=(user_id,))
+            timer.daemon = True
+            self._merge_timers[user_id] = timer
+            timer.start()
+
+    def _snapshot(self, user_id: int, store: FAISS) -> None:
+        """Write the in-memory index as the new base; caller holds the tenant lock."""
+        path = self._tenant_path(user_id)
+        last_segment = self._last_segment.get(user_id, 0)
+        generation = self._read_manifest(path).get("generation", 0) + 1
+        base_name = f"base_{generation:08d}"
+        _save_atomically(store, os.path.join(path, base_name))
+        _write_json_atomically(
+            os.path.join(path, MANIFEST_FILE),
+            {"base": base_name, "last_segment": last_segment, "generation": generation},
+        )
+        self._base_segment[user_id] = last_segment
+        self._prune(path)
+
+    def _merge(self, user_id: int) -> None:
+        with self._lock:
+            self._merge_timers.pop(user_id, None)
+        try:
+            with self._tenant_lock(user_id):
+                last_segment = self._last_segment.get(user_id, 0)
+                if last_segment <= self._base_segment.get(user_id, 0):
+                    return
+                store = self.get(user_id)
+                if store is None:
+                    return
+                self._maybe_promote(user_id, store)
+                self._snapshot(user_id, store)
+            logger.info(f"Merged vector index segments for user_id={user_id} up to segment {last_segment}")
+        except Exception as e:
+            logger.error(f"Failed to merge vector index segments for user_id={user_id}: {e}")
+
+    def _compact(self, user_id: int, document_ids: Optional[Collection[int]] = None) -> None:
+        """Physically drop tombstoned chunks (only those of ``document_ids``, if given) and snapshot the result."""
+        try:
+            with self._tenant_lock(user_id):
+                store = self.get(user_id)
+                tombstones = self._tombstones.get(user_id)
+                if store is None or not tombstones:
+                    return
+                purged = {
+                    document_id: file_path for document_id, file_path in tombstones.items()
+                    if document_ids is None or document_id in document_ids
+                }
+                dead_ids = self._dead_chunk_ids(store, purged)
+                if dead_ids:
+                    self._rebuild(store, index_type_of(store.index), exclude=dead_ids)
+                self._snapshot(user_id, store)
+
+                # The snapshot no longer holds these chunks, so their tombstones can go
+                remaining = {
+                    document_id: file_path for document_id, file_path in tombstones.items()
+                    if document_id not in purged
+                }
+                self._tombstones[user_id] = remaining
+                self._dead_chunks[user_id] = len(self._dead_chunk_ids(store, remaining))
+                tombstones_path = os.path.join(self._tenant_path(user_id), TOMBSTONES_FILE)
+                if remaining:
+                    _write_json_atomically(tombstones_path, remaining)
+                elif os.path.exists(tombstones_path):
+                    os.remove(tombstones_path)
+            logger.info(f"Compacted {len(dead_ids)} dead chunks from vector index of user_id={user_id}")
+        except Exception as e:
+            logger.error(f"Failed to compact vector index for user_id={user_id}: {e}")
+
+    def merge_pending(self) -> None:
+        """Snapshot every partition with unmerged segments; called on shutdown."""
+        with self._lock:
+            timers = dict(self._merge_timers)
+            self._merge_timers.clear()
+        for user_id, timer in timers.items():
+            timer.cancel()
+            self._merge(user_id)
+
+    def migrate_from(self, legacy_store: FAISS) -> int:
+        """Split a shared index into per-user partitions, reusing its stored vectors."""
+        grouped: Dict[int, list] = {}
+        for position, doc_id in legacy_store.index_to_docstore_id.items():
+            doc = legacy_store.docstore.search(doc_id)
+            if not isinstance(doc, Document) or doc.metadata.get("user_id") is None:
+                continue
+            grouped.setdefault(doc.metadata["user_id"], []).append((position, doc_id, doc))
+
+        migrated = 0
+        for user_id, rows in grouped.items():
+            text_embeddings = [
+                (doc.page_content, legacy_store.index.reconstruct(int(position)).tolist())
+                for position, _, doc in rows
+            ]
+            metadatas = [doc.metadata for _, _, doc in rows]
+            ids = [doc_id for _, doc_id, _ in rows]
+            delta = FAISS.from_embeddings(text_embeddings, self.embeddings, metadatas=metadatas, ids=ids)
+            self._commit_delta(user_id, delta)
+            migrated += len(rows)
+
+        logger.info(f"Migrated {migrated} chunks for {len(grouped)} users into per-user indexes")
+        return migrated